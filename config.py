@@ -10,6 +10,25 @@ class ServerConfig:
     format_num = True  # 输出时是否将中文数字转为阿拉伯数字
     format_punc = True  # 输出时是否启用标点符号引擎
     format_spell = True  # 输出时是否调整中英之间的空格
+    punc_window = 300    # 长文本边识别边加标点，每攒够这么多字加一次标点
+
+    seg_mode = 'fixed'          # 音频分段方式：'fixed' 按固定时长重叠切分；'vad' 尽量在静音处切分，片段间无需重叠
+    vad_min_silence = 0.5       # 至少多长的静音才可作为切分点，单位秒
+
+    shared_memory = False       # 是否经共享内存把音频交给识别进程（省去队列的序列化与管道传输）
+    shared_memory_size = 256    # 共享内存大小，单位 MB，不够用时自动改走队列
+
+    outbox_size = 64            # 每个连接待发送结果的上限，超出时合并最旧的中间结果
+
+    result_ttl = 600            # 任务超过这么多秒没有新片段，视为已废弃，清理其中间结果
+    result_max = 256            # 最多同时保留多少个任务的中间结果，超出时清理最久没有新片段的任务
+
+    num_workers = 1             # 识别进程数，ParaformerArgs.num_threads 由各进程平分
+    task_parallel = 4           # 同一任务（如长文件）的片段最多同时分给几个识别进程
+    batch_size = 8              # 每个识别进程一次最多合批识别的片段数
+
+    queue_busy = 3600           # 排队的音频超过这么多秒时，以「繁忙」拒绝新的文件任务
+    queue_max = 7200            # 排队的音频超过这么多秒时，暂停接收文件音频，直到识别进程消化
 
 
 # 客户端配置
@@ -29,6 +48,7 @@ class ClientConfig:
     restore_clip = True         # 模拟粘贴后是否恢复剪贴板
 
     save_audio = True           # 是否保存录音文件
+    archive_buffer = 30         # 录音文件在独立线程中写入，最多积压多少秒音频，写入跟不上时丢弃并报告
     audio_name_len = 20         # 将录音识别结果的前多少个字存储到录音文件名中，建议不要超过200
 
     trash_punc = '，。,.'        # 识别结果要消除的末尾标点
@@ -44,8 +64,21 @@ class ClientConfig:
     mic_seg_duration = 15           # 麦克风听写时分段长度：15秒
     mic_seg_overlap = 2             # 麦克风听写时分段重叠：2秒
 
+    ring_duration = 10              # 录音环形缓冲区可容纳多少秒音频
+    drain_chunk = 0.2               # 录音数据每攒够多少秒，成块交给发送协程
+    preroll = 0.3                   # 预录音时长：任务开始时带上按下快捷键前多少秒的音频，设为 0 则不带
+
+    vad_trim = False                # 是否在上传前略去长静音（按能量检测），节省带宽与识别时间，时间戳仍与原音频对齐
+    vad_threshold = -45             # 能量低于多少 dBFS 视为静音
+    vad_min_silence = 1.0           # 静音超过多少秒才略去
+    vad_padding = 0.3               # 略去静音时，两端各保留多少秒
+
     file_seg_duration = 25           # 转录文件时分段长度
     file_seg_overlap = 2             # 转录文件时分段重叠
+    file_window = 300                # 转录文件时，已发送但服务端尚未取走的音频最多多少秒
+    file_concurrency = 2             # 转录多个文件时，同时转录几个（每个各用一个连接）
+
+    binary_frame = True             # 音频以二进制帧发送（省去 base64 编解码），连接旧版服务端时改为 False
 
 
 class ModelPaths:
@@ -53,6 +86,7 @@ class ModelPaths:
     paraformer_path = Path() / 'models' / 'paraformer-offline-zh' / 'model.int8.onnx'
     tokens_path = Path() / 'models' / 'paraformer-offline-zh' / 'tokens.txt'
     punc_model_dir = Path() / 'models' / 'punc_ct-transformer_cn-en'
+    vad_model = Path() / 'models' / 'silero_vad.onnx'   # 'vad' 分段模式所需的 Silero VAD 模型，可选
 
 
 class ParaformerArgs:
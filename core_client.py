@@ -62,12 +62,13 @@ os.chdir(BASE_DIR)
 # 导入业务模块
 from config import ClientConfig as Config
 from util.client_cosmic import console, Cosmic
-from util.client_stream import stream_open, stream_close
+from util.client_stream import stream_open, stream_close, stream_drain_loop
+from util.client_archive import Archiver
 from util.client_shortcut_handler import bond_shortcut
 from util.client_recv_result import recv_result
 from util.client_show_tips import show_mic_tips, show_file_tips
 from util.client_hot_update import update_hot_all, observe_hot
-from util.client_transcribe import transcribe_check, transcribe_send, transcribe_recv
+from util.client_transcribe import transcribe_files
 from util.client_adjust_srt import adjust_srt
 from util.empty_working_set import empty_current_working_set
 
@@ -98,8 +99,13 @@ async def main_mic():
     # 实时更新热词
     observer = observe_hot()
 
-    # 打开音频流
+    # 打开音频流，并定时取出录音缓冲区中的音频
     Cosmic.stream = stream_open()
+    asyncio.create_task(stream_drain_loop())
+
+    # 启动录音存档线程
+    if Config.save_audio:
+        Cosmic.archiver = Archiver()
 
     # Ctrl-C 关闭音频流
     signal.signal(signal.SIGINT, stream_close)
@@ -119,15 +125,15 @@ async def main_mic():
 async def main_file(files: List[Path]):
     show_file_tips()
 
+    # 文本、字幕文件直接调整，音视频文件并发转录
+    media = []
     for file in files:
         if file.suffix in ['.txt', '.json', 'srt']:
             adjust_srt(file)
         else:
-            await transcribe_check(file)
-            await asyncio.gather(
-                transcribe_send(file),
-                transcribe_recv(file)
-            )
+            media.append(file)
+    if media:
+        await transcribe_files(media)
 
     if Cosmic.websocket:
         await Cosmic.websocket.close()
@@ -52,11 +52,17 @@ try:
     import websockets
 
     from config import ServerConfig as Config
+    from config import ModelPaths
     from util.server_cosmic import Cosmic, console
     from util.server_check_model import check_model
     from util.server_ws_recv import ws_recv
     from util.server_ws_send import ws_send
     from util.server_init_recognizer import init_recognizer
+    from util.server_init_merger import init_merger
+    from util.server_dispatcher import Dispatcher
+    from util.server_schedule import schedule
+    from util.server_shared_audio import SharedAudio
+    from util.server_alive import AliveSockets
     from util.empty_working_set import empty_current_working_set
 
 except Exception as e:
@@ -73,19 +79,38 @@ async def main():
     try:
         check_model()
 
+        if Config.seg_mode == 'vad' and not ModelPaths.vad_model.exists():
+            console.print(f'未找到 VAD 模型：{ModelPaths.vad_model}，改为按固定时长分段', style='bright_red')
+            Config.seg_mode = 'fixed'
+
         print(f'\n项目地址：https://github.com/HaujetZhao/CapsWriter-Offline')
         print(f'绑定的服务地址：{Config.addr}:{Config.port}\n')
 
-        # 初始化跨进程列表
-        Cosmic.sockets_id = multiprocessing.Manager().list()
-
-        # 启动识别子进程
-        recognize_process = multiprocessing.Process(
-            target=init_recognizer,
-            args=(Cosmic.queue_in, Cosmic.queue_out, Cosmic.sockets_id),
+        # 初始化跨进程的连接存活表
+        Cosmic.sockets_alive = AliveSockets(4096)
+
+        # 初始化共享内存音频缓冲区
+        if Config.shared_memory:
+            Cosmic.shared_audio = SharedAudio(Config.shared_memory_size * 1024 * 1024)
+
+        # 启动识别子进程池，由调度器把排队的片段派给空闲的识别进程
+        Cosmic.dispatcher = Dispatcher(Config.num_workers, Config.task_parallel, Config.batch_size)
+        for index in range(Config.num_workers):
+            recognize_process = multiprocessing.Process(
+                target=init_recognizer,
+                args=(index, Cosmic.dispatcher, Cosmic.queue_merge,
+                      Cosmic.sockets_alive, Cosmic.shared_audio),
+                daemon=True
+            )
+            recognize_process.start()
+
+        # 启动合并子进程，按序合并各识别进程的片段结果
+        merge_process = multiprocessing.Process(
+            target=init_merger,
+            args=(Cosmic.queue_merge, Cosmic.queue_out),
             daemon=True
         )
-        recognize_process.start()
+        merge_process.start()
 
         # 等待子进程准备就绪 (模型加载)
         # 这里的 get() 之前会卡死，现在解除了文件锁，应该能正常通过
@@ -102,7 +127,7 @@ async def main():
                                 max_size=None)
 
         send = ws_send()
-        await asyncio.gather(recv, send)
+        await asyncio.gather(recv, send, schedule())
 
     except Exception as e:
         print(f"RUNTIME ERROR: {e}")
@@ -122,6 +147,8 @@ def init():
             Cosmic.queue_out.put(None)
         except:
             pass
+        if Cosmic.shared_audio:
+            Cosmic.shared_audio.close(unlink=True)
         sys.exit(0)
 
 
@@ -0,0 +1,99 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from config import ClientConfig as Config
+from util.client_cosmic import console
+from util.client_create_file import create_file
+from util.client_write_file import write_file
+from util.client_finish_file import finish_file
+
+
+class Archiver:
+    """
+    录音存档线程：录音文件的创建、写入、完成都在这个线程中进行，
+    磁盘慢或 ffmpeg 卡住时，不会拖慢事件循环中的发送与接收
+
+    事件循环只把操作放入队列，不等待。待写入的音频不超过 archive_buffer 秒，
+    写入跟不上时丢弃新来的音频并计数，在该文件完成时报告。
+    创建与完成文件的操作不受此限制，总会按顺序执行。
+    """
+
+    def __init__(self):
+        self.items = deque()            # (操作, 任务 id, 参数)
+        self.pending = 0                # 队列中待写入的音频帧数
+        self.limit = 0                  # 待写入帧数的上限，按最近一个文件的采样率换算
+        self.samplerates = {}           # 任务 id -> 采样率，用于换算丢弃的时长
+        self.dropped = {}               # 任务 id -> 丢弃的帧数
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def push(self, item: tuple):
+        with self.condition:
+            self.items.append(item)
+            self.condition.notify()
+
+    def open(self, task_id: str, channels: int, time_start: float, samplerate: int) -> Future:
+        """新建录音文件，返回的 Future 在文件写完、关闭后得到文件路径"""
+        future = Future()
+        with self.condition:
+            self.limit = int(Config.archive_buffer * samplerate)
+            self.samplerates[task_id] = samplerate
+            self.dropped[task_id] = 0
+        self.push(('open', task_id, (channels, time_start, samplerate, future)))
+        return future
+
+    def write(self, task_id: str, data: np.ndarray):
+        """写入音频，积压过多时丢弃"""
+        with self.condition:
+            if self.pending + len(data) > self.limit:
+                self.dropped[task_id] = self.dropped.get(task_id, 0) + len(data)
+                return
+            self.pending += len(data)
+            self.items.append(('write', task_id, data))
+            self.condition.notify()
+
+    def finish(self, task_id: str):
+        """完成录音文件，不等待"""
+        self.push(('finish', task_id, None))
+
+    def run(self):
+        files = {}      # 任务 id -> (文件路径, 文件, Future)
+        while True:
+            with self.condition:
+                while not self.items:
+                    self.condition.wait()
+                action, task_id, payload = self.items.popleft()
+                if action == 'write':
+                    self.pending -= len(payload)
+
+            try:
+                if action == 'open':
+                    channels, time_start, samplerate, future = payload
+                    try:
+                        file_path, file = create_file(channels, time_start, samplerate)
+                    except Exception as e:
+                        future.set_exception(e)
+                        raise
+                    files[task_id] = (file_path, file, future)
+
+                elif action == 'write' and task_id in files:
+                    write_file(files[task_id][1], payload)
+
+                elif action == 'finish' and task_id in files:
+                    file_path, file, future = files.pop(task_id)
+                    with self.condition:
+                        dropped = self.dropped.pop(task_id, 0)
+                        samplerate = self.samplerates.pop(task_id)
+                    try:
+                        finish_file(file)
+                    except Exception as e:
+                        future.set_exception(e)
+                        raise
+                    future.set_result(file_path)
+                    if dropped:
+                        console.print(f'[bright_red]录音存档跟不上，文件中丢弃了 {dropped / samplerate:.2f}s 音频：{file_path}')
+            except Exception as e:
+                print(e)
@@ -43,3 +43,11 @@ async def check_websocket() -> bool:
     #
     # else:
     #     return False
+
+
+async def open_websocket():
+    # 另开一个连接，供并发转录文件使用，连不上时返回 None
+    for _ in range(3):
+        with Handler():
+            return await websockets.connect(f"ws://{Config.addr}:{Config.port}", max_size=None)
+    return None
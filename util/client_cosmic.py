@@ -5,6 +5,8 @@ import sys
 from pathlib import Path
 from typing import List, Union
 
+from util.client_ring_buffer import RingBuffer
+
 from rich.console import Console 
 from rich.theme import Theme
 my_theme = Theme({'markdown.code':'cyan', 'markdown.item.number':'yellow'})
@@ -20,6 +22,12 @@ class Cosmic:
     queue_out: Queue
     loop: Union[None, AbstractEventLoop] = None
     websocket: websockets.WebSocketClientProtocol = None
-    audio_files = {}
+    audio_files = {}                        # 任务 id -> 录音文件写完后得到路径的 Future
+    archiver = None                         # 录音存档线程，保存录音时才启动
+    task_id: Union[None, str] = None     # 正在录音的任务 id
+    header: Union[None, dict] = None     # 已发给服务端的控制头，取消任务时据此判断服务端是否收到过该任务
     stream: Union[None, sd.InputStream] = None
+    ring: Union[None, RingBuffer] = None     # 录音环形缓冲区
+    samplerate = 48000                      # 录音采样率
+    draining = False                        # 是否正把录音缓冲区的数据交给发送协程，仅事件循环中修改
     kwd_list: List[str] = []
@@ -9,7 +9,7 @@ from wave import Wave_write
 import tempfile
 
 
-def create_file(channels: int, time_start: float) -> Tuple[Path, Union[Popen, Wave_write]]:
+def create_file(channels: int, time_start: float, samplerate: int = 48000) -> Tuple[Path, Union[Popen, Wave_write]]:
 
     time_year = time.strftime('%Y', time.localtime(time_start))
     time_month = time.strftime('%m', time.localtime(time_start))
@@ -26,7 +26,7 @@ def create_file(channels: int, time_start: float) -> Tuple[Path, Union[Popen, Wa
         # 构造ffmpeg命令行
         ffmpeg_command = [
             'ffmpeg', '-y', 
-            '-f', 'f32le', '-ar', '48000', '-ac', f'{channels}', '-i', '-',
+            '-f', 'f32le', '-ar', f'{samplerate}', '-ac', f'{channels}', '-i', '-',
             '-b:a', '192k', file_path,
         ]
         # 执行ffmpeg命令行，得到 Popen
@@ -36,5 +36,5 @@ def create_file(channels: int, time_start: float) -> Tuple[Path, Union[Popen, Wa
         file = wave.open(str(file_path), 'w')
         file.setnchannels(channels)
         file.setsampwidth(2)
-        file.setframerate(48000)
+        file.setframerate(samplerate)
     return file_path, file
@@ -6,6 +6,7 @@ import wave
 def finish_file(file: Union[Popen, wave.Wave_write]):
     if isinstance(file, Popen):
         file.stdin.close()  # 停止输入，ffmpeg 会自动关闭
+        file.wait()         # 等 ffmpeg 写完文件再返回，之后才能重命名
 
     elif isinstance(file, wave.Wave_write):
         file.close()
@@ -40,7 +40,7 @@ async def recv_result():
 
             if Config.save_audio:
                 # 重命名录音文件
-                file_audio = rename_audio(message['task_id'], text, message['time_start'])
+                file_audio = await rename_audio(message['task_id'], text, message['time_start'])
 
                 # 记录写入 md 文件
                 write_md(text, message['time_start'], file_audio)
@@ -1,16 +1,21 @@
 from pathlib import Path
 from typing import Union
 import time
+import asyncio
 from util.client_cosmic import Cosmic, console
 from config import ClientConfig as Config
 from os import makedirs
 import re
 
 
-def rename_audio(task_id, text, time_start) -> Union[Path, None]:
+async def rename_audio(task_id, text, time_start) -> Union[Path, None]:
 
-    # 获取旧文件名
-    file_path = Path(Cosmic.audio_files.pop(task_id))
+    # 等存档线程写完文件，获取旧文件名
+    try:
+        file_path = Path(await asyncio.wrap_future(Cosmic.audio_files.pop(task_id)))
+    except Exception as e:
+        console.print(f'    录音文件保存失败：{e}')
+        return
 
     # 确保旧文件存在
     if not file_path.exists():
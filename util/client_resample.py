@@ -0,0 +1,56 @@
+from math import gcd, ceil
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class Resampler:
+    """
+    流式多相重采样，把任意采样率的多声道录音转为 16000Hz 单声道
+
+    先以一次矩阵向量乘完成声道混合，再做有理数倍的多相 FIR 滤波：
+    上采样 L 倍、低通、下采样 M 倍，只计算真正要输出的样本。
+    滤波器历史和输出相位跨块保留，分块处理与整段处理的结果一致。
+    """
+
+    def __init__(self, rate_in: int, channels: int, rate_out: int = 16000, zeros: int = 16):
+        divisor = gcd(int(rate_in), int(rate_out))
+        self.up = int(rate_out) // divisor          # L
+        self.down = int(rate_in) // divisor         # M
+        self.mix = np.full(channels, 1 / channels, dtype=np.float32)    # 声道混合权重
+        self.passthrough = self.up == self.down
+
+        # 低通滤波器：加 Kaiser 窗的 sinc，截止频率取输入、输出奈奎斯特频率中较低者的 90%
+        # 每侧 zeros 个过零点，增益乘以 L 以补偿插零
+        factor = max(self.up, self.down)
+        length = 2 * zeros * factor + 1
+        cutoff = 0.5 / factor * 0.9
+        n = np.arange(length) - (length - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, 8.0) * self.up
+
+        # 拆成 L 个相位的子滤波器，并反转以便与滑动窗口直接点乘
+        self.width = ceil(length / self.up)
+        taps = np.concatenate([taps, np.zeros(self.width * self.up - length)])
+        self.phases = taps.reshape(self.width, self.up).T[:, ::-1].astype(np.float32)
+
+        self.history = np.zeros(self.width - 1, dtype=np.float32)   # 上一块末尾的样本
+        self.time = (length - 1) // 2       # 下一个输出样本在上采样时间轴上的位置，起点补偿滤波器延迟
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        """输入 (帧数, 声道数) 的 float32 数据，返回 16000Hz 单声道 float32 数据"""
+        mono = data @ self.mix
+        if self.passthrough:
+            return mono
+
+        # 本块可以输出的样本：上采样时间 < 本块帧数 * L
+        end = len(mono) * self.up
+        times = np.arange(self.time, end, self.down)
+        self.time += len(times) * self.down - end
+
+        # 每个输出样本取以它为结尾的 width 个输入样本，与所在相位的子滤波器点乘
+        samples = np.concatenate([self.history, mono])
+        windows = sliding_window_view(samples, self.width)
+        output = np.einsum('ij,ij->i', windows[times // self.up], self.phases[times % self.up])
+
+        self.history = samples[len(samples) - self.width + 1:]
+        return output.astype(np.float32)
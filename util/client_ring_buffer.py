@@ -0,0 +1,51 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    录音用的环形缓冲区，单生产者、单消费者，无锁
+
+    录音回调只推进 write，消费协程只推进 read，两个计数器都只增不减，
+    各由一方写入，另一方只读，无需加锁。缓冲区预先分配，录音回调写入时不分配内存。
+    计数器是累计的帧数，取模后才是缓冲区内的位置。
+    """
+
+    def __init__(self, frames: int, channels: int):
+        self.buffer = np.zeros((frames, channels), dtype=np.float32)
+        self.size = frames
+        self.write = 0      # 已写入的帧数，仅录音回调修改
+        self.read = 0       # 已取出的帧数，仅消费协程修改
+        self.dropped = 0    # 缓冲区满时丢弃的帧数，仅录音回调修改
+        self.reported = 0   # 已报告过的丢弃帧数，仅消费协程修改
+
+    def put(self, data: np.ndarray):
+        """在录音回调中写入数据；消费方跟不上、缓冲区已满时丢弃并计数"""
+        n = len(data)
+        if self.write + n - self.read > self.size:
+            self.dropped += n
+            return
+        start = self.write % self.size
+        first = min(n, self.size - start)
+        self.buffer[start:start + first] = data[:first]
+        self.buffer[:n - first] = data[first:]
+
+        # 数据写好之后才推进计数器，消费方不会读到写了一半的数据
+        self.write += n
+
+    def available(self) -> int:
+        return self.write - self.read
+
+    def get(self, n: int) -> np.ndarray:
+        """取出最多 n 帧数据，返回新数组"""
+        n = min(n, self.write - self.read)
+        start = self.read % self.size
+        first = min(n, self.size - start)
+        data = np.empty((n, self.buffer.shape[1]), dtype=np.float32)
+        data[:first] = self.buffer[start:start + first]
+        data[first:] = self.buffer[:n - first]
+        self.read += n
+        return data
+
+    def keep(self, n: int):
+        """只保留最近的 n 帧，丢弃更早的数据"""
+        self.read = max(self.read, self.write - n)
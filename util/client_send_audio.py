@@ -6,35 +6,83 @@ import numpy as np
 import base64
 import json
 import websockets
-from util.client_create_file import create_file
-from util.client_write_file import write_file
-from util.client_finish_file import finish_file
+from util.client_resample import Resampler
+from util.client_vad import SilenceTrimmer
 import uuid
 
 
 
-async def send_message(message):
+async def send_message(message, data: bytes = None):
     # 发送数据
+    # 二进制模式下 message 是控制头（可为 None），data 是裸 PCM
     if Cosmic.websocket is None or Cosmic.websocket.closed:
-        if message['is_final']:
+        if message and message['is_final']:
             Cosmic.audio_files.pop(message['task_id'])
             console.print('    服务端未连接，无法发送\n')
     else:
         try:
-            await Cosmic.websocket.send(json.dumps(message))
+            if message:
+                await Cosmic.websocket.send(json.dumps(message))
+            if data:
+                await Cosmic.websocket.send(data)
         except websockets.ConnectionClosedError as e:
-            if message['is_final']:
+            if message and message['is_final']:
                 console.print(f'[red]连接中断了')
         except Exception as e:
             print('出错了')
             print(e)
 
 
+async def send_cancel(task_id: str):
+    # 通知服务端取消任务，丢弃已提交的音频
+    # 只有服务端收到过该任务的控制头或音频时才需要通知
+    # 消息带上控制头的各字段和空的 data，旧版服务端会把它当作一块空音频，不会出错
+    header = Cosmic.header
+    if header is None or header['task_id'] != task_id:
+        return
+    if Cosmic.websocket is None or Cosmic.websocket.closed:
+        return
+    message = {**header, 'type': 'cancel', 'is_final': False, 'data': ''}
+    message.pop('skip', None)
+    try:
+        await Cosmic.websocket.send(json.dumps(message))
+    except websockets.ConnectionClosedError:
+        pass
+
+
+async def send_pieces(message, pieces, header_sent: bool) -> bool:
+    """
+    依次发送音频段，pieces 是 [(之前略去的静音秒数, 音频), ...]
+    二进制模式下，首帧前发送控制头；略去了静音时，再发一次带 skip 的控制头告知时长
+    按顺序等待发送完成，控制头与其后的音频不会被其它发送打乱
+    返回控制头是否已发送
+    """
+    for skip, piece in pieces:
+        pcm = piece.tobytes()
+        if Config.binary_frame:
+            header = None
+            if skip:
+                header = {**message, 'skip': skip}
+            elif not header_sent:
+                header = message
+            header_sent = True
+            await send_message(header, pcm)
+        else:
+            payload = {**message, 'data': base64.b64encode(pcm).decode('utf-8')}
+            if skip:
+                payload['skip'] = skip
+            await send_message(payload)
+        Cosmic.header = message
+    return header_sent
+
+
 async def send_audio():
     try:
 
         # 生成唯一任务 ID
         task_id = str(uuid.uuid1())
+        Cosmic.task_id = task_id
+        Cosmic.header = None
 
         # 任务起始时间
         time_start = 0
@@ -43,8 +91,18 @@ async def send_audio():
         cache = []
         duration = 0
 
-        # 保存音频文件
-        file_path, file = '', None
+        # 保存音频文件，由存档线程写入
+        archiver = Cosmic.archiver if Config.save_audio else None
+        archiving = False
+
+        # 二进制模式下，控制头每个任务只发一次
+        header_sent = False
+
+        # 重采样器，收到第一块数据时按声道数创建，滤波状态在整个任务中保留
+        resampler = None
+
+        # 略去长静音
+        trimmer = SilenceTrimmer() if Config.vad_trim else None
 
         # 开始取数据
         # task: {'type', 'time', 'data'}
@@ -59,9 +117,10 @@ async def send_audio():
                     continue
 
                 # 创建音频文件
-                if Config.save_audio and not file_path:
-                    file_path, file = create_file(task['data'].shape[1], time_start)
-                    Cosmic.audio_files[task_id] = file_path
+                if archiver and not archiving:
+                    Cosmic.audio_files[task_id] = archiver.open(
+                        task_id, task['data'].shape[1], time_start, Cosmic.samplerate)
+                    archiving = True
 
                 # 获取音频数据
                 if cache:
@@ -71,9 +130,9 @@ async def send_audio():
                     data = task['data']
 
                 # 保存音频至本地文件
-                duration += len(data) / 48000
-                if Config.save_audio:
-                    write_file(file, data)
+                duration += len(data) / Cosmic.samplerate
+                if archiving:
+                    archiver.write(task_id, data)
 
                 # 发送音频数据用于识别
                 message = {
@@ -84,15 +143,17 @@ async def send_audio():
                     'time_start': time_start,       # 录音起始时间
                     'time_frame': task['time'],     # 该帧时间
                     'source': 'mic',                # 数据来源：从麦克风收到的数据
-                    'data': base64.b64encode(       # 数据
-                                np.mean(data[::3], axis=1).tobytes()
-                            ).decode('utf-8'),
+                    'result_delta': True,           # 中间结果只要新增部分
                 }
-                task = asyncio.create_task(send_message(message))
+                if resampler is None:
+                    resampler = Resampler(Cosmic.samplerate, data.shape[1])
+                pcm = resampler.process(data)
+                pieces = trimmer.process(pcm) if trimmer else [(0, pcm)]
+                header_sent = await send_pieces(message, pieces, header_sent)
             elif task['type'] ==  'finish':
-                # 完成写入本地文件
-                if Config.save_audio:
-                    finish_file(file)
+                # 完成写入本地文件，不等待
+                if archiving:
+                    archiver.finish(task_id)
 
                 console.print(f'任务标识：{task_id}')
                 console.print(f'    录音时长：{duration:.2f}s')
@@ -106,9 +167,20 @@ async def send_audio():
                     'time_start': time_start,
                     'time_frame': task['time'],
                     'source': 'mic',
-                    'data': '',
+                    'result_delta': True,
                 }
-                task = asyncio.create_task(send_message(message))
+                if trimmer:
+                    pieces = trimmer.process(np.zeros(0, dtype=np.float32), final=True)
+                    header_sent = await send_pieces({**message, 'is_final': False}, pieces, header_sent)
+                if not Config.binary_frame:
+                    message['data'] = ''
+                await send_message(message)
                 break
+    except asyncio.CancelledError:
+        # 任务取消了，关闭已创建的录音文件
+        if archiving:
+            archiver.finish(task_id)
+            Cosmic.audio_files.pop(task_id, None)
+        raise
     except Exception as e:
         print(e)
@@ -6,7 +6,8 @@ import time
 import asyncio
 from threading import Event
 from concurrent.futures import ThreadPoolExecutor
-from util.client_send_audio import send_audio
+from util.client_send_audio import send_audio, send_cancel
+from util.client_stream import stream_begin, stream_finish, stream_cancel
 from util.my_status import Status
 
 
@@ -36,9 +37,9 @@ def launch_task():
     # 记录开始时间
     t1 = time.time()
 
-    # 将开始标志放入队列
+    # 将开始标志放入队列，随后开始取出录音数据（含预录音）
     asyncio.run_coroutine_threadsafe(
-        Cosmic.queue_in.put({'type': 'begin', 'time': t1, 'data': None}),
+        stream_begin({'type': 'begin', 'time': t1, 'data': None}),
         Cosmic.loop
     )
 
@@ -60,8 +61,14 @@ def cancel_task():
     Cosmic.on = False
     status.stop()
 
-    # 取消协程任务
+    # 取消协程任务，停止取出录音数据
     task.cancel()
+    asyncio.run_coroutine_threadsafe(stream_cancel(), Cosmic.loop)
+
+    # 通知服务端取消任务，不再识别已提交的音频
+    if Cosmic.task_id:
+        asyncio.run_coroutine_threadsafe(send_cancel(Cosmic.task_id), Cosmic.loop)
+        Cosmic.task_id = None
 
 
 def finish_task():
@@ -69,11 +76,12 @@ def finish_task():
 
     # 通知停止录音，关掉滚动条
     Cosmic.on = False
+    Cosmic.task_id = None
     status.stop()
 
-    # 通知结束任务
+    # 通知结束任务（先取出录音缓冲区中剩余的音频）
     asyncio.run_coroutine_threadsafe(
-        Cosmic.queue_in.put(
+        stream_finish(
             {'type': 'finish',
              'time': time.time(),
              'data': None
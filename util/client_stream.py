@@ -1,5 +1,7 @@
 
 from util.client_cosmic import console, Cosmic
+from util.client_ring_buffer import RingBuffer
+from config import ClientConfig as Config
 import numpy as np 
 import sounddevice as sd
 import asyncio
@@ -13,17 +15,63 @@ def record_callback(indata: np.ndarray,
                     frames: int,
                     time_info,
                     status: sd.CallbackFlags) -> None:
-    if not Cosmic.on:
-        return
-    asyncio.run_coroutine_threadsafe(
-        Cosmic.queue_in.put(
+    # 只把数据写入预分配的环形缓冲区，不分配内存，也不与事件循环交互
+    # 没有任务时也持续写入，任务开始时可以带上按键前的一小段音频
+    Cosmic.ring.put(indata)
+
+
+def stream_drain(final=False):
+    """
+    在事件循环中调用：从环形缓冲区按 drain_chunk 成块取出音频，放入 queue_in
+    final 为真时，不足一块的剩余数据也一并取出
+    """
+    ring = Cosmic.ring
+    chunk = int(Config.drain_chunk * Cosmic.samplerate)
+    while ring.available() >= chunk or (final and ring.available()):
+        Cosmic.queue_in.put_nowait(
             {'type': 'data',
              'time': time.time(),
-             'data': indata.copy(),
-             },
-        ),
-        Cosmic.loop
-    )
+             'data': ring.get(chunk),
+             }
+        )
+
+    # 报告因消费不及而丢弃的帧数
+    if ring.dropped > ring.reported:
+        console.print(f'[bright_red]录音缓冲区已满，丢弃了 {(ring.dropped - ring.reported) / Cosmic.samplerate:.2f}s 音频')
+        ring.reported = ring.dropped
+
+
+async def stream_drain_loop():
+    # 常驻协程：有任务时定时取出环形缓冲区中的音频
+    # 没有任务时只保留最近 preroll 秒，作为下一个任务的预录音
+    while True:
+        await asyncio.sleep(Config.drain_chunk / 2)
+        if Cosmic.draining:
+            stream_drain()
+        else:
+            Cosmic.ring.keep(int(Config.preroll * Cosmic.samplerate))
+
+
+async def stream_begin(message: dict):
+    # 开始任务：先放入开始标志，之后取出的数据（含预录音）都排在它后面
+    Cosmic.ring.keep(int(Config.preroll * Cosmic.samplerate))
+    await Cosmic.queue_in.put(message)
+    Cosmic.draining = True
+
+
+async def stream_finish(message: dict):
+    # 结束任务前，先取出缓冲区中剩余的音频，保证数据排在结束标志之前
+    stream_drain(final=True)
+    Cosmic.draining = False
+    await Cosmic.queue_in.put(message)
+
+
+async def stream_cancel():
+    # 取消任务：停止取出数据，清掉发送协程来不及处理的数据
+    Cosmic.draining = False
+    while not Cosmic.queue_in.empty():
+        Cosmic.queue_in.get_nowait()
+        Cosmic.queue_in.task_done()
 
 
 def stream_close(signum, frame):
@@ -61,9 +109,26 @@ def stream_open():
         console.print("没有找到麦克风设备", end='\n\n', style='bright_red')
         input('按回车键退出'); sys.exit()
 
+    # 优先直接以 16000Hz 录音，省去重采样；设备不支持时用它的默认采样率，由发送协程重采样
+    samplerate = 16000
+    try:
+        sd.check_input_settings(device=None, channels=channels, dtype='float32', samplerate=16000)
+    except Exception:
+        try:
+            samplerate = int(sd.query_devices(kind='input')['default_samplerate'])
+        except Exception:
+            samplerate = 48000
+    console.print(f'录音采样率：{samplerate}', end='\n\n')
+
+    # 环形缓冲区，声道数、采样率不变时沿用，重启音频流不丢失未取出的数据
+    if (Cosmic.ring is None or Cosmic.ring.buffer.shape[1] != channels
+            or Cosmic.samplerate != samplerate):
+        Cosmic.ring = RingBuffer(int(Config.ring_duration * samplerate), channels)
+    Cosmic.samplerate = samplerate
+
     stream = sd.InputStream(
-        samplerate=48000,
-        blocksize=int(0.05 * 48000),  # 0.05 seconds
+        samplerate=samplerate,
+        blocksize=int(0.05 * samplerate),  # 0.05 seconds
         device=None,
         dtype="float32",
         channels=channels,
@@ -9,7 +9,10 @@ import time
 import re
 import wave
 import asyncio
+import bisect
 import subprocess
+from collections import deque
+from typing import List
 
 import numpy as np
 import websockets
@@ -17,10 +20,62 @@ import typer
 import colorama
 from util import srt_from_txt
 from util.client_cosmic import console, Cosmic
-from util.client_check_websocket import check_websocket
+from util.client_check_websocket import check_websocket, open_websocket
+from util.client_vad import SilenceTrimmer
 from config import ClientConfig as Config
 
 
+class Window:
+    """
+    发送窗口：已发送但服务端尚未取走的音频不超过 file_window 秒
+    服务端确认过位置 0 才启用，旧版服务端不发确认，也就不限制
+    确认的位置在原音频的时间轴上，略去的静音没有发送，要从中扣除
+    """
+
+    def __init__(self):
+        self.acked = 0          # 服务端已取走的音频位置（秒）
+        self.enabled = False    # 服务端是否支持流控
+        self.rejected = False   # 服务端繁忙，拒绝了任务
+        self.skip_ends = []     # 每段略去的静音在原音频中的结束位置
+        self.skip_totals = []   # 截至该段累计略去的静音时长
+        self.event = asyncio.Event()
+
+    def skip(self, end: float, seconds: float):
+        """记录一段略去的静音"""
+        total = self.skip_totals[-1] if self.skip_totals else 0
+        self.skip_ends.append(end)
+        self.skip_totals.append(total + seconds)
+
+    def update(self, message):
+        if message['type'] == 'busy':
+            self.rejected = True
+        else:
+            self.enabled = True
+            self.acked = max(self.acked, message['offset'])
+        self.event.set()
+
+    def acked_sent(self) -> float:
+        """服务端已取走的、实际发送过的音频时长"""
+        i = bisect.bisect_right(self.skip_ends, self.acked)
+        return self.acked - (self.skip_totals[i - 1] if i else 0)
+
+    async def wait(self, sent: float):
+        """sent 是实际发送过的音频时长，不含略去的静音"""
+        while self.enabled and not self.rejected and sent - self.acked_sent() > Config.file_window:
+            self.event.clear()
+            await self.event.wait()
+
+
+windows = {}    # 任务 id -> 发送窗口
+progress = {}   # 任务 id -> [文件名, 已发送时长, 音频总时长, 已转录时长]
+
+
+def show_progress():
+    # 并发转录时各文件的进度显示在同一行
+    line = ' | '.join(f'{name} 发送 {sent:.0f}/{total:.0f}s 转录 {done:.0f}s'
+                      for name, sent, total, done in progress.values())
+    console.print(f'\033[K    {line}', end='\r')
+
 
 async def transcribe_check(file: Path):
     # 检查连接
@@ -32,72 +87,229 @@ async def transcribe_check(file: Path):
         console.print(f'文件不存在：{file}')
         return False
 
-async def transcribe_send(file: Path):
+async def transcribe_files(files: List[Path]):
+    """
+    并发转录多个文件，最后汇总吞吐量
+    服务端的每个连接同时只处理一个任务，所以每路并发各用一个连接，第一路沿用 Cosmic.websocket
+    """
+    if not await check_websocket():
+        console.print('无法连接到服务端')
+        sys.exit()
+
+    lanes = [Cosmic.websocket]
+    for _ in range(min(Config.file_concurrency, len(files)) - 1):
+        websocket = await open_websocket()
+        if websocket:
+            lanes.append(websocket)
+
+    files = deque(files)
+    count, total = 0, 0
+    time_start = time.time()
+
+    async def lane(websocket):
+        nonlocal count, total
+        while files:
+            file = files.popleft()
+            if await transcribe_check(file) is False:
+                continue
+            _, duration = await asyncio.gather(
+                transcribe_send(file, websocket),
+                transcribe_recv(file, websocket)
+            )
+            if duration:
+                count += 1
+                total += duration
+
+    await asyncio.gather(*(lane(websocket) for websocket in lanes))
+    for websocket in lanes[1:]:
+        await websocket.close()
+
+    # 汇总吞吐量：每秒转录的音频秒数
+    elapsed = time.time() - time_start
+    console.print(f'\n共转录 {count} 个文件，音频总长 {total:.2f}s，耗时 {elapsed:.2f}s，'
+                  f'吞吐量 {total / max(elapsed, 1e-6):.2f} 秒音频/秒')
+
+
+async def transcribe_send(file: Path, websocket=None):
 
     # 获取连接
-    websocket = Cosmic.websocket
+    websocket = websocket or Cosmic.websocket
 
     # 生成任务 id
     task_id = str(uuid.uuid1())
+    window = windows[task_id] = Window()
+    progress[task_id] = [Path(file).name, 0, 0, 0]
     console.print(f'\n任务标识：{task_id}')
     console.print(f'    处理文件：{file}')
 
     # 获取音频数据，ffmpeg 输出采样率 16000，单声道，float32 格式
+    # 边解码边读取，每读满一块就发送，服务端的识别与本地的解码同时进行
     ffmpeg_cmd = [
         "ffmpeg",
+        "-hide_banner",
+        "-nostats",
         "-i", file,
         "-f", "f32le",
         "-ac", "1",
         "-ar", "16000",
         "-",
     ]
-    process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-    console.print(f'    正在提取音频', end='\r')
-    data = process.stdout.read()
-    audio_duration = len(data) / 4 / 16000
-    console.print(f'    音频长度：{audio_duration:.2f}s')
-
-    # 构建分段消息，发送给服务端
-    offset = 0
-    while True:
-        chunk_end = offset + 16000*4*60
-        is_final = False if chunk_end < len(data) else True
-        message = {
-            'task_id': task_id,                     # 任务 ID
-            'seg_duration': Config.file_seg_duration,    # 分段长度
-            'seg_overlap': Config.file_seg_overlap,      # 分段重叠
-            'is_final': is_final,                       # 是否结束
-            'time_start': time.time(),              # 录音起始时间
-            'time_frame': time.time(),              # 该帧时间
-            'source': 'file',                       # 数据来源：从文件读的数据
-            'data': base64.b64encode(
-                        data[offset: chunk_end]
-                    ).decode('utf-8'),
-        }
-        offset = chunk_end
-        progress = min(offset / 4 / 16000, audio_duration)
+    process = await asyncio.create_subprocess_exec(
+        *ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    # 从 ffmpeg 的输出中得到音频时长，用于显示进度
+    stderr_task = asyncio.create_task(ffmpeg_duration(process.stderr, task_id))
+
+    message = {
+        'task_id': task_id,                     # 任务 ID
+        'seg_duration': Config.file_seg_duration,    # 分段长度
+        'seg_overlap': Config.file_seg_overlap,      # 分段重叠
+        'is_final': False,                      # 是否结束
+        'time_start': time.time(),              # 录音起始时间
+        'time_frame': time.time(),              # 该帧时间
+        'source': 'file',                       # 数据来源：从文件读的数据
+        'result_delta': True,                   # 中间结果只要新增部分
+        'queue_status': True,                   # 排队时接收排队状态
+        'ack': True,                            # 接收确认，控制发送窗口
+    }
+
+    # 二进制模式下，控制头只在开头与结尾发送，音频以二进制帧发送
+    if Config.binary_frame:
         await websocket.send(json.dumps(message))
-        console.print(f'    发送进度：{progress:.2f}s', end='\r')
+
+    # 略去长静音
+    trimmer = SilenceTrimmer() if Config.vad_trim else None
+
+    # 预读一块，读不到下一块时，当前块就是最后一块
+    # sent 是实际发送的音频时长，position 是已发送到原音频的哪个位置
+    sent, position = 0, 0
+    chunk = await read_chunk(process.stdout)
+    while True:
+        next_chunk = await read_chunk(process.stdout) if chunk else b''
+        is_final = not next_chunk
+        message['time_frame'] = time.time()
+
+        samples = np.frombuffer(chunk, dtype=np.float32)
+        pieces = trimmer.process(samples, final=is_final) if trimmer else [(0, samples)]
+        for skip, piece in pieces:
+            if skip:
+                position += skip
+                window.skip(position, skip)
+            if Config.binary_frame:
+                # 略去了静音时，再发一次带 skip 的控制头告知时长
+                if skip:
+                    await websocket.send(json.dumps({**message, 'skip': skip}))
+                if len(piece):
+                    await websocket.send(piece.tobytes())
+            else:
+                payload = {**message, 'data': base64.b64encode(piece.tobytes()).decode('utf-8')}
+                if skip:
+                    payload['skip'] = skip
+                await websocket.send(json.dumps(payload))
+            sent += len(piece) / 16000
+            position += len(piece) / 16000
+
+        # 结束的控制头要在最后一块数据之后发送
+        if is_final:
+            message['is_final'] = True
+            if not Config.binary_frame:
+                message['data'] = ''
+            await websocket.send(json.dumps(message))
+
+        if task_id in progress:
+            progress[task_id][1] = position
+            progress[task_id][2] = max(progress[task_id][2], position)
+            show_progress()
         if is_final:
             break
+        chunk = next_chunk
+
+        # 等服务端取走足够的音频，再发下一块
+        await window.wait(sent)
+        if window.rejected:
+            process.kill()
+            break
 
-async def transcribe_recv(file: Path):
+    await process.wait()
+    await stderr_task
+
+
+async def read_chunk(stream: asyncio.StreamReader) -> bytes:
+    """读取一块 60 秒的音频，只有读到结尾时才会不足一块"""
+    try:
+        return await stream.readexactly(16000 * 4 * 60)
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+
+
+async def ffmpeg_duration(stream: asyncio.StreamReader, task_id: str):
+    """读完 ffmpeg 的日志输出（避免管道写满阻塞 ffmpeg），从中解析音频时长"""
+    log, found = '', False
+    while data := await stream.read(4096):
+        if found:
+            continue
+        log += data.decode('utf-8', 'ignore')
+        match = re.search(r'Duration: (\d+):(\d+):(\d+\.\d+)', log)
+        if match and task_id in progress:
+            h, m, sec = match.groups()
+            progress[task_id][2] = int(h) * 3600 + int(m) * 60 + float(sec)
+            found = True
+
+
+async def transcribe_recv(file: Path, websocket=None) -> float:
+    """接收转录结果并写入文件，返回转录的音频时长，任务被拒绝时返回 0"""
 
     # 获取连接
-    websocket = Cosmic.websocket
+    websocket = websocket or Cosmic.websocket
 
     # 接收结果
+    # 增量结果的时间戳是相对 timestamp_base 的 float32 数组，逐条累积 token 和时间戳
+    tokens, timestamps = [], []
     async for message in websocket:
         message = json.loads(message)
-        console.print(f'    转录进度: {message["duration"]:.2f}s', end='\r')
+
+        # 确认：服务端已取走的音频位置
+        if message.get('type') == 'ack':
+            if message['task_id'] in windows:
+                windows[message['task_id']].update(message)
+            continue
+
+        # 繁忙：服务端排队的音频过多，拒绝了任务
+        if message.get('type') == 'busy':
+            if message['task_id'] in windows:
+                windows.pop(message['task_id']).update(message)
+            progress.pop(message['task_id'], None)
+            console.print(f'\033[K    {file} 被拒绝：服务端繁忙，排队的音频已有 {message["queued"]}s，请稍后再试')
+            return 0
+
+        # 排队状态：服务端繁忙，片段还在等待识别
+        if message.get('type') == 'queue':
+            if message['position']:
+                console.print(f'\033[K    排队中：前面还有 {message["position"]} 个片段，'
+                              f'预计 {message["eta"]:.1f}s 后开始', end='\r')
+            continue
+
+        if isinstance(message['timestamps'], str):
+            tokens += message['tokens']
+            timestamps += np.round(np.frombuffer(
+                base64.b64decode(message['timestamps']), dtype=np.float32
+            ).astype(np.float64) + message.get('timestamp_base', 0), 3).tolist()
+        if message['task_id'] in progress:
+            progress[message['task_id']][3] = message['duration']
+            show_progress()
         if message['is_final']:
+            windows.pop(message['task_id'], None)
+            progress.pop(message['task_id'], None)
             break
 
+    # 旧版服务端不发增量结果，最终结果就是完整的
+    if not isinstance(message['timestamps'], str):
+        tokens = message['tokens']
+        timestamps = message['timestamps']
+
     # 解析结果
     text_merge = message['text']
     text_split = re.sub('[，。？]', '\n', text_merge)
-    timestamps = message['timestamps']
-    tokens = message['tokens']
 
     # 得到文件名
     json_filename = Path(file).with_suffix(".json")
@@ -114,5 +326,8 @@ async def transcribe_recv(file: Path):
     srt_from_txt.one_task(txt_filename)
 
     process_duration = message['time_complete'] - message['time_start']
-    console.print(f'\033[K    处理耗时：{process_duration:.2f}s')
+    console.print(f'\033[K{file}')
+    console.print(f'    音频长度：{message["duration"]:.2f}s')
+    console.print(f'    处理耗时：{process_duration:.2f}s')
     console.print(f'    识别结果：\n[green]{message["text"]}')
+    return message['duration']
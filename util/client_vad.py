@@ -0,0 +1,89 @@
+from collections import deque
+from typing import List, Tuple
+
+import numpy as np
+
+from config import ClientConfig as Config
+
+
+class SilenceTrimmer:
+    """
+    按能量检测静音，略去长静音，减少上传与识别的数据量
+
+    处理 16000Hz 单声道 float32 音频，以 30ms 为一帧计算能量。
+    静音持续超过 vad_min_silence 秒时，只保留两端各 vad_padding 秒，中间的略去。
+    返回的每一段音频都带着它之前略去的静音时长，由服务端据此调整偏移，时间戳仍与原音频对齐。
+    """
+
+    frame = 480     # 30ms
+
+    def __init__(self):
+        self.threshold = 10 ** (Config.vad_threshold / 20)      # 能量阈值，由 dBFS 换算为 RMS
+        self.padding = round(Config.vad_padding * 16000 / self.frame)
+        self.limit = max(round(Config.vad_min_silence * 16000 / self.frame) - self.padding, self.padding)
+
+        self.rest = np.zeros(0, dtype=np.float32)   # 不足一帧的剩余样本
+        self.silence = 0        # 当前静音已持续的帧数
+        self.held = deque()     # 静音开头 padding 帧之后、暂未决定去留的静音帧
+        self.skipped = 0        # 已略去、尚未报告的静音帧数
+
+    def process(self, samples: np.ndarray, final=False) -> List[Tuple[float, np.ndarray]]:
+        """
+        送入音频，返回 [(之前略去的静音秒数, 音频), ...]
+        final 为真时，末尾的静音直接丢弃，只报告其时长，不足一帧的剩余样本原样输出
+        """
+        samples = np.concatenate([self.rest, samples])
+        end = len(samples) // self.frame * self.frame
+        frames = samples[:end].reshape(-1, self.frame)
+        self.rest = samples[end:]
+        loud = np.sqrt(np.mean(frames ** 2, axis=1)) >= self.threshold
+
+        pieces, kept = [], []
+
+        def flush():
+            # 把已保留的帧连同之前略去的静音时长作为一段输出
+            if kept:
+                pieces.append((self.skipped * self.frame / 16000, np.concatenate(kept)))
+                kept.clear()
+                self.skipped = 0
+
+        for frame, speech in zip(frames, loud):
+            if speech:
+                # 静音结束：短静音全部保留；长静音中间已略去，只保留末尾 padding 帧
+                if len(self.held) >= self.limit:
+                    flush()
+                    tail = list(self.held)[-self.padding:] if self.padding else []
+                    self.skipped += len(self.held) - len(tail)
+                    kept.extend(tail)
+                else:
+                    kept.extend(self.held)
+                self.held.clear()
+                self.silence = 0
+                kept.append(frame)
+                continue
+
+            # 静音开头的 padding 帧总会保留，之后的帧先暂存
+            self.silence += 1
+            if self.silence <= self.padding:
+                kept.append(frame)
+                continue
+            self.held.append(frame)
+            if len(self.held) > self.limit:
+                # 开始略去静音，先输出此前保留的帧，略去的时长记在下一段之前
+                flush()
+                self.held.popleft()
+                self.skipped += 1
+
+        if final:
+            self.skipped += len(self.held)
+            self.held.clear()
+            if len(self.rest):
+                kept.append(self.rest)
+                self.rest = np.zeros(0, dtype=np.float32)
+        flush()
+
+        # 末尾略去的静音也要报告，服务端据此计入任务时长
+        if final and self.skipped:
+            pieces.append((self.skipped * self.frame / 16000, np.zeros(0, dtype=np.float32)))
+            self.skipped = 0
+        return pieces
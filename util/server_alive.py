@@ -0,0 +1,40 @@
+from multiprocessing import RawArray
+from typing import Tuple
+
+from util.server_classes import Task
+
+
+class AliveSockets:
+    """
+    跨进程的连接存活表
+
+    每个连接占一个槽位，槽位里写入该连接的序号，断开时清零。
+    任务带着槽位与序号，识别进程比对一下就知道连接是否存活，
+    不需要 IPC，也不用线性查找。槽位被新连接复用后序号不同，
+    旧连接遗留的任务仍会被识别为已断开。
+    """
+
+    def __init__(self, slots: int):
+        self.serials = RawArray('Q', slots)     # 槽位 -> 连接序号，0 表示空闲
+        self.free = list(range(slots))          # 空闲槽位，仅主进程使用
+        self.serial = 0                         # 最近分配的序号，仅主进程使用
+
+    def open(self) -> Tuple[int, int]:
+        """为新连接分配槽位，返回 (槽位, 序号)；槽位用尽时返回 (-1, 0)，视为始终存活"""
+        self.serial += 1
+        if not self.free:
+            return -1, 0
+        slot = self.free.pop()
+        self.serials[slot] = self.serial
+        return slot, self.serial
+
+    def close(self, slot: int):
+        if slot < 0:
+            return
+        self.serials[slot] = 0
+        self.free.append(slot)
+
+    def alive(self, task: Task) -> bool:
+        if task.socket_slot < 0:
+            return True
+        return self.serials[task.socket_slot] == task.socket_serial
@@ -9,6 +9,7 @@ from util.server_cosmic import console
 def check_model():
     for key, path in ModelPaths.__dict__.items() :
         if key.startswith('_'): continue
+        if key == 'vad_model': continue     # 可选模型，缺失时改为按固定时长分段
         if path.exists(): continue
         console.print(f'''
     未能找到模型文件 
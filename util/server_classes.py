@@ -1,3 +1,6 @@
+from copy import copy
+
+
 class Task:
     def __init__(self, source: str,
                  data,
@@ -7,24 +10,64 @@ class Task:
                  socket_id: str,
                  is_final: bool,
                  time_start: float,
-                 time_submit: float) -> None:
+                 time_submit: float,
+                 shm_offset: int = None,
+                 shm_length: int = 0,
+                 shm_slot: int = 0,
+                 socket_slot: int = -1,
+                 socket_serial: int = 0,
+                 index: int = 0,
+                 overlap_prev: float = 0,
+                 skip: float = 0,
+                 delta: bool = False,
+                 queue_status: bool = False,
+                 ack: bool = False) -> None:
         self.source = source
         self.data = data
+        self.shm_offset = shm_offset    # 若音频放在共享内存里，data 为 None，用偏移和长度定位
+        self.shm_length = shm_length
+        self.shm_slot = shm_slot
         self.offset = offset
-        self.overlap = overlap
+        self.overlap = overlap              # 与下一个片段重叠的时长
+        self.overlap_prev = overlap_prev    # 与上一个片段重叠的时长
+        self.skip = skip                    # 与上一个片段之间略去的静音时长，计入任务时长
         self.task_id = task_id
         self.socket_id = socket_id
+        self.socket_slot = socket_slot      # 连接在存活表中的槽位与序号
+        self.socket_serial = socket_serial
         self.is_final = is_final
         self.time_start = time_start
         self.time_submit = time_submit
         self.samplerate = 16000
+        self.index = index              # 片段在任务中的序号，用于按序合并
+        self.delta = delta              # 客户端是否接收增量结果
+        self.queue_status = queue_status    # 客户端是否接收排队状态
+        self.ack = ack                  # 客户端是否接收确认，用于流控
+
+        # 以下由识别进程填写
+        self.duration = 0               # 片段时长
+        self.tokens = []                # 片段的字级 token
+        self.timestamps = []            # 片段的字级时间戳
+
+    @property
+    def seconds(self) -> float:
+        """片段音频时长"""
+        length = len(self.data) if self.data is not None else self.shm_length
+        return length / 4 / self.samplerate
+
+
+class Cancel:
+    # 通知合并进程：该任务已被客户端取消
+    def __init__(self, task_id) -> None:
+        self.task_id = task_id
 
 
 class Result:
-    def __init__(self, task_id, socket_id, source) -> None:
+    def __init__(self, task_id, socket_id, source, delta=False) -> None:
         self.task_id = task_id          # 任务 id
         self.socket_id = socket_id      # socket id
         self.source = source            # 是从 'file' 还是 'mic' 的音频流得到的结果
+        self.delta = delta              # 客户端是否接收增量结果
 
         self.duration = 0               # 全部音频时长
         self.time_start = 0             # 录音开始的时刻
@@ -33,5 +76,19 @@ class Result:
 
         self.tokens = []                # 字级 token
         self.timestamps = []            # 字级 token 的时间戳
-        self.text = ''                  # 合并的文字
+        self.text = ''                  # 合并的文字，最终结果才拼接完整
+        self.pieces = []                # 合并中的文字，分段存放，各片段追加一段
+        self.length = 0                 # 合并中的文字总长度
+        self.splice = 0                 # 增量结果的 text 替换完整文字中从此位置起的部分
         self.is_final = False           # 是否已完成所有片段识别
+        self.index = 0                  # 下一个待合并的片段序号
+
+    def with_content(self, tokens, timestamps, text, splice=0) -> 'Result':
+        """复制一份只带指定内容的结果，用于只传递新增部分，text 替换完整文字中从 splice 起的部分"""
+        result = copy(self)
+        result.tokens = tokens
+        result.timestamps = timestamps
+        result.text = text
+        result.splice = splice
+        result.pieces = []
+        return result
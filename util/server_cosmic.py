@@ -1,8 +1,11 @@
 import sys
 from pathlib import Path
 from multiprocessing import Queue
-from typing import Dict, List
+from typing import Dict, Union
 import websockets
+from util.server_shared_audio import SharedAudio
+from util.server_alive import AliveSockets
+from util.server_dispatcher import Dispatcher
 from rich.console import Console 
 console = Console(highlight=False)
 
@@ -12,6 +15,9 @@ console = Console(highlight=False)
 
 class Cosmic:
     sockets: Dict[str, websockets.WebSocketClientProtocol] = {}
-    sockets_id: List
-    queue_in = Queue()
+    outboxes: Dict[str, 'Outbox'] = {}
+    sockets_alive: AliveSockets
+    dispatcher: Dispatcher
+    queue_merge = Queue()
     queue_out = Queue()
+    shared_audio: Union[None, SharedAudio] = None
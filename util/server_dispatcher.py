@@ -0,0 +1,173 @@
+import time
+from collections import deque, OrderedDict
+from multiprocessing import Queue, RawArray
+from typing import Dict, Deque, List
+
+from util.server_classes import Task
+
+
+class Dispatcher:
+    """
+    调度片段，派发给空闲的识别进程
+
+    片段先在主进程排队：麦克风的片段总是优先，文件的片段在各连接之间轮流取，
+    一个长文件不会让其它连接一直等。识别进程空闲时，才一次派给它最多 batch_size 个片段。
+    成批识别时短片段要补齐到最长片段的长度，所以麦克风片段单独成批，不与文件片段混在一起；
+    新来的麦克风片段要等最先空闲的识别进程识别完手头的那一批。
+
+    每个识别进程有自己的任务队列，一批片段作为一条消息放入；负载是「已派发 - 已完成」的片段数。
+    已派发数只由主进程写，已完成数只由对应的识别进程写，无需加锁。
+    同一任务的片段最多同时分给 parallel 个识别进程；片段乱序完成时由合并进程按序号重排。
+    """
+
+    def __init__(self, num_workers: int, parallel: int, batch_size: int):
+        self.queues = [Queue() for _ in range(num_workers)]
+        self.completed = RawArray('Q', num_workers)     # 各识别进程已完成的片段数
+        self.finished = Queue()                         # 识别进程识别完一批后放入自己的序号，唤醒调度协程
+
+        # 以下仅主进程使用
+        self.dispatched = [0] * num_workers             # 各识别进程已派发的片段数
+        self.parallel = max(1, parallel)
+        self.batch_size = max(1, batch_size)
+        self.inflight: Dict[str, Dict[int, int]] = {}   # 任务 id -> {识别进程: 该任务在其上最后一个片段的派发序号}
+        self.mic: Deque[Task] = deque()                 # 排队中的麦克风片段
+        self.files: Dict[str, Deque[Task]] = OrderedDict()  # socket id -> 排队中的文件片段，按轮转顺序排列
+        self.busy_since = [0.0] * num_workers           # 各识别进程当前这一批的派发时刻
+        self.busy_count = [0] * num_workers             # 各识别进程当前这一批的片段数
+        self.seg_time = 1.0                             # 识别一个片段的平均耗时（秒），用于估计排队时间
+        self.queued = 0.0                               # 排队中的音频总时长（秒）
+        self.wakeup = None                              # 调度协程等待的事件，由调度协程创建
+
+    def depth(self, worker: int) -> int:
+        return self.dispatched[worker] - self.completed[worker]
+
+    def put(self, task: Task):
+        """片段入队，等待调度"""
+        if task.source == 'mic':
+            self.mic.append(task)
+        else:
+            self.files.setdefault(task.socket_id, deque()).append(task)
+        self.queued += task.seconds
+        if self.wakeup:
+            self.wakeup.set()
+
+    def drop(self, socket_id: str) -> List[Task]:
+        """连接断开，移除它排队中的片段并返回"""
+        dropped = list(self.files.pop(socket_id, ()))
+        dropped += [task for task in self.mic if task.socket_id == socket_id]
+        self.mic = deque(task for task in self.mic if task.socket_id != socket_id)
+        for task in dropped:
+            self.inflight.pop(task.task_id, None)
+            self.queued -= task.seconds
+        return dropped
+
+    def cancel(self, task_id: str) -> List[Task]:
+        """任务被取消，移除它排队中的片段并返回"""
+        cancelled = [task for task in self.mic if task.task_id == task_id]
+        self.mic = deque(task for task in self.mic if task.task_id != task_id)
+        for socket_id, queue in list(self.files.items()):
+            if not any(task.task_id == task_id for task in queue):
+                continue
+            cancelled += [task for task in queue if task.task_id == task_id]
+            queue = deque(task for task in queue if task.task_id != task_id)
+            if queue:
+                self.files[socket_id] = queue
+            else:
+                del self.files[socket_id]
+        self.inflight.pop(task_id, None)
+        self.queued -= sum(task.seconds for task in cancelled)
+        return cancelled
+
+    def forget(self, task_id: str):
+        """任务中途断开，不会再有结束片段，清除其记录"""
+        self.inflight.pop(task_id, None)
+
+    def usable(self, task: Task, worker: int) -> bool:
+        """未达并行上限时片段可派给任意进程，否则只能派给该任务已占用的进程"""
+        inflight = self.inflight.get(task.task_id, {})
+        inflight = {w: seq for w, seq in inflight.items() if self.completed[w] < seq}
+        self.inflight[task.task_id] = inflight
+        return worker in inflight or len(inflight) < self.parallel
+
+    def take(self, worker: int) -> List[Task]:
+        """
+        为空闲的识别进程取出一批片段：有麦克风片段时只取麦克风片段，
+        否则在文件连接间轮流取
+        """
+        batch = []
+        while self.mic and len(batch) < self.batch_size and self.usable(self.mic[0], worker):
+            batch.append(self.mic.popleft())
+        if batch:
+            return batch
+
+        progressed = True
+        while progressed and len(batch) < self.batch_size:
+            progressed = False
+            for socket_id in list(self.files):
+                if len(batch) >= self.batch_size:
+                    break
+                queue = self.files[socket_id]
+                if not self.usable(queue[0], worker):
+                    continue
+                batch.append(queue.popleft())
+                progressed = True
+                # 取过的连接排到末尾，下一轮从其它连接开始
+                if queue:
+                    self.files.move_to_end(socket_id)
+                else:
+                    del self.files[socket_id]
+        return batch
+
+    def dispatch(self) -> List[Task]:
+        """把排队的片段派给空闲的识别进程，返回派出的片段"""
+        now = time.time()
+        dispatched = []
+        for worker in range(len(self.queues)):
+            if self.depth(worker):
+                continue
+
+            # 上一批刚完成，更新单个片段的平均耗时
+            if self.busy_count[worker]:
+                seg_time = (now - self.busy_since[worker]) / self.busy_count[worker]
+                self.seg_time = self.seg_time * 0.8 + seg_time * 0.2
+                self.busy_count[worker] = 0
+
+            batch = self.take(worker)
+            for task in batch:
+                self.dispatched[worker] += 1
+                if task.is_final:
+                    self.inflight.pop(task.task_id, None)
+                else:
+                    self.inflight[task.task_id][worker] = self.dispatched[worker]
+                self.queued -= task.seconds
+            if batch:
+                self.queues[worker].put(batch)      # 整批放入，识别进程取到即可识别，无需再等凑批
+                self.busy_since[worker] = now
+                self.busy_count[worker] = len(batch)
+                dispatched += batch
+
+        # 浮点累加的误差，队列清空时归零
+        if not self.mic and not self.files:
+            self.queued = 0.0
+        return dispatched
+
+    def status(self) -> Dict[str, dict]:
+        """估计各文件连接下一个片段前面还有多少片段、多久后开始识别"""
+        report = {}
+        for rank, (socket_id, queue) in enumerate(self.files.items()):
+            position = len(self.mic) + rank
+            report[socket_id] = {
+                'task_id': queue[0].task_id,
+                'position': position,
+                'queued': len(queue),
+                'eta': position * self.seg_time / len(self.queues),
+            }
+        return report
+
+    def done(self, worker: int):
+        """识别进程完成一个片段后调用"""
+        self.completed[worker] += 1
+
+    def idle(self, worker: int):
+        """识别进程识别完一批后调用"""
+        self.finished.put(worker)
@@ -0,0 +1,116 @@
+import time
+import threading
+from itertools import count
+from queue import PriorityQueue
+from multiprocessing import Queue
+import signal
+from platform import system
+from config import ServerConfig as Config
+from config import ModelPaths
+from util.server_cosmic import console
+from util.server_recognize import reorder, recognize, cancel, evict, format_partial, format_final
+from util.server_recognize import formatting
+from util.server_classes import Cancel
+from util.empty_working_set import empty_current_working_set
+
+
+def disable_jieba_debug():
+    # 关闭 jieba 的 debug
+    import jieba
+    import logging
+    jieba.setLogLevel(logging.INFO)
+
+
+serial = count()     # 格式化队列中同一优先级按放入顺序取出
+
+
+def put_format(queue_format: PriorityQueue, item):
+    """
+    放入格式化队列：麦克风的结果优先，不必排在长文件的标点窗口之后
+    同一任务的结果来源相同，仍按顺序处理；取消通知排在文件结果一级
+    """
+    priority = 0 if getattr(item, 'source', None) == 'mic' else 1
+    queue_format.put((priority, next(serial), item))
+
+
+def format_results(punc_model, queue_format: PriorityQueue, queue_out: Queue):
+    """
+    格式化线程：中间结果的新增文字边收边加标点，
+    最终结果加标点、转数字、调空格后，交给主进程发送
+    """
+    while True:
+        _, _, result = queue_format.get()
+        if isinstance(result, Cancel):
+            formatting.pop(result.task_id, None)
+            continue
+        if not result.is_final:
+            format_partial(punc_model, result.task_id, result.text, result.splice)
+            continue
+        result.text = format_final(punc_model, result.task_id, result.text)
+        queue_out.put(result)
+
+
+def init_merger(queue_merge: Queue, queue_out: Queue):
+    """
+    合并进程：接收各识别进程识别好的片段，按序合并到任务结果，结果交给主进程发送
+    最终结果先交给格式化线程，长文本加标点时不耽误其它任务的合并
+    """
+
+    # Ctrl-C 退出
+    signal.signal(signal.SIGINT, lambda signum, frame: exit())
+
+    # 导入模块
+    with console.status("载入模块中…", spinner="bouncingBall", spinner_style="yellow"):
+        from funasr_onnx import CT_Transformer
+        disable_jieba_debug()
+    console.print('[green4]模块加载完成', end='\n\n')
+
+    # 载入标点模型
+    punc_model = None
+    if Config.format_punc:
+        console.print('[yellow]标点模型载入中', end='\r'); t1 = time.time()
+        punc_model = CT_Transformer(ModelPaths.punc_model_dir, quantize=True)
+        console.print(f'[green4]标点模型载入完成，耗时 {time.time() - t1 :.2f}s', end='\n\n')
+
+    # 等待所有识别进程载入模型
+    for _ in range(Config.num_workers):
+        queue_merge.get()
+
+    # 清空物理内存工作集
+    if system() == 'Windows':
+        empty_current_working_set()
+
+    # 启动格式化线程
+    queue_format = PriorityQueue()
+    threading.Thread(target=format_results,
+                     args=(punc_model, queue_format, queue_out),
+                     daemon=True).start()
+
+    queue_out.put(True)  # 通知主进程加载完了
+
+    evict_time = time.time()
+    while True:
+        # 每隔一段时间清理废弃任务的中间结果
+        if time.time() - evict_time >= 10:
+            evict_time = time.time()
+            for task_id in evict():
+                put_format(queue_format, Cancel(task_id))
+
+        # 从队列中获取识别好的片段
+        # 阻塞最多1秒，便于中断退出
+        try:
+            task = queue_merge.get(timeout=1)
+        except:
+            continue
+
+        # 任务被取消，格式化线程也丢弃它的进度
+        if isinstance(task, Cancel):
+            cancel(task.task_id)
+            put_format(queue_format, task)
+            continue
+
+        for task in reorder(task):
+            result = recognize(task)        # 合并结果
+            put_format(queue_format, result)    # 格式化线程边收边加标点，最终结果由它返回
+            if not result.is_final:
+                queue_out.put(result)       # 返回中间结果
@@ -4,65 +4,68 @@ from multiprocessing import Queue
 import signal
 from platform import system
 from config import ServerConfig as Config
-from config import ParaformerArgs, ModelPaths
+from config import ParaformerArgs
 from util.server_cosmic import console
-from util.server_recognize import recognize
+from util.server_recognize import decode
 from util.empty_working_set import empty_current_working_set
 
 
 
-def disable_jieba_debug():
-    # 关闭 jieba 的 debug
-    import jieba
-    import logging
-    jieba.setLogLevel(logging.INFO)
-
-
-def init_recognizer(queue_in: Queue, queue_out: Queue, sockets_id):
+def init_recognizer(index: int, dispatcher, queue_merge: Queue, sockets_alive, shared_audio=None):
 
     # Ctrl-C 退出
     signal.signal(signal.SIGINT, lambda signum, frame: exit())
 
+    # 本进程的任务队列
+    queue_in = dispatcher.queues[index]
+
     # 导入模块
     with console.status("载入模块中…", spinner="bouncingBall", spinner_style="yellow"):
         import sherpa_onnx
-        from funasr_onnx import CT_Transformer
-        disable_jieba_debug()
-    console.print('[green4]模块加载完成', end='\n\n')
+    console.print(f'[green4]识别进程 {index} 模块加载完成', end='\n\n')
 
-    # 载入语音模型
+    # 载入语音模型，线程数由各识别进程平分
     console.print('[yellow]语音模型载入中', end='\r'); t1 = time.time()
-    recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(
-        **{key: value for key, value in ParaformerArgs.__dict__.items() if not key.startswith('_')}
-    )
-    console.print(f'[green4]语音模型载入完成', end='\n\n')
-
-    # 载入标点模型
-    punc_model = None
-    if Config.format_punc:
-        console.print('[yellow]标点模型载入中', end='\r')
-        punc_model = CT_Transformer(ModelPaths.punc_model_dir, quantize=True)
-        console.print(f'[green4]标点模型载入完成', end='\n\n')
-
-    console.print(f'模型加载耗时 {time.time() - t1 :.2f}s', end='\n\n')
+    args = {key: value for key, value in ParaformerArgs.__dict__.items() if not key.startswith('_')}
+    args['num_threads'] = max(1, ParaformerArgs.num_threads // Config.num_workers)
+    recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(**args)
+    console.print(f'[green4]识别进程 {index} 语音模型载入完成，耗时 {time.time() - t1 :.2f}s', end='\n\n')
 
     # 清空物理内存工作集
     if system() == 'Windows':
         empty_current_working_set()
 
-    queue_out.put(True)  # 通知主进程加载完了
+    queue_merge.put(True)  # 通知合并进程加载完了
 
     while True:
-        # 从队列中获取任务消息
+        # 从队列中获取一批任务，由调度器凑好
         # 阻塞最多1秒，便于中断退出
         try:
-            task = queue_in.get(timeout=1)       
+            tasks = queue_in.get(timeout=1)
         except:
             continue
 
-        if task.socket_id not in sockets_id:    # 检查任务所属的连接是否存活
+        batch = []
+        for task in tasks:
+            if not sockets_alive.alive(task):       # 检查任务所属的连接是否存活
+                if task.shm_offset is not None:
+                    shared_audio.release(task)
+                dispatcher.done(index)
+                continue
+            if task.shm_offset is not None:         # 音频在共享内存中，直接映射
+                task.data = shared_audio.read(task)
+            batch.append(task)
+
+        if not batch:
+            dispatcher.idle(index)
             continue
 
-        result = recognize(recognizer, punc_model, task)   # 执行识别
-        queue_out.put(result)      # 返回结果
+        batch = decode(recognizer, batch)       # 成批识别
+
+        for task in batch:
+            if task.shm_offset is not None:     # 识别完，释放共享内存
+                shared_audio.release(task)
+            queue_merge.put(task)       # 交给合并进程
+            dispatcher.done(index)
+        dispatcher.idle(index)          # 唤醒调度协程，派下一批
 
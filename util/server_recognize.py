@@ -1,5 +1,7 @@
 import re
 import time
+from collections import OrderedDict
+from typing import List
 
 import numpy as np 
 
@@ -12,6 +14,11 @@ from rich import inspect
 
 
 results = {}
+pending = {}        # 任务 id -> {片段序号: 已识别、等待合并的片段}
+formatting = {}     # 任务 id -> 边识别边加标点的进度
+cancelled = {}      # 最近被取消的任务 id，迟到的片段直接丢弃
+touched = OrderedDict()     # 任务 id -> 最近收到片段的时刻，最久未更新的排在最前
+evicted = 0         # 因过期或超量而清理的任务数
 
 
 def format_text(text, punc_model):
@@ -26,29 +33,186 @@ def format_text(text, punc_model):
     return text
 
 
-def recognize(recognizer, punc_model, task: Task):
+class Formatted:
+    # 长文本边识别边加标点，只保留末尾未成句的文字作为下一次的上下文
+    def __init__(self):
+        self.done = ''                      # 已成句、格式化完成的文字
+        self.start = 0                      # 已成句部分在原始文字中的结束位置
+        self.raw = ''                       # 原始文字中 start 之后、待加标点的部分
+        self.edge = ''                      # 原始文字中 start 之前的末尾几十个字，用于核对最终结果
+        self.next = Config.punc_window      # 待加标点的文字攒到多长再加标点
+        self.broken = False                 # 增量改写了已成句的部分，最终结果要整篇重新格式化
+
+
+def raw_position(raw: str, formatted: str) -> int:
+    """formatted 是 raw 开头一段加标点、调空格的结果，返回这一段在 raw 中的结束位置"""
+    count = len(re.sub(r'[\s，。？、]', '', formatted))
+    for i, char in enumerate(raw):
+        if count == 0:
+            return i
+        if not re.match(r'[\s，。？、]', char):
+            count -= 1
+    return len(raw)
+
+
+def format_partial(punc_model, task_id, text, splice):
+    """收到中间结果的增量文字（替换原始文字中 splice 之后的部分），攒够一个窗口就加标点，把成句的部分先格式化好"""
+    if not (Config.format_punc and punc_model):
+        return
+    state = formatting.setdefault(task_id, Formatted())
+
+    # 末尾 token 重拼时改写了已成句的部分，已格式化的文字作废
+    if splice < state.start:
+        state.broken = True
+    if state.broken:
+        return
+    state.raw = state.raw[:splice - state.start] + text
+    if len(state.raw) < state.next:
+        return
+
+    text = state.raw
+    if Config.format_spell:
+        text = adjust_space(text)       # 调空格
+    text = punc_model(text)[0]          # 加标点
+
+    # 在最后一个句末标点处断开，之后的原始文字留作下次的上下文
+    # 迟迟不成句时，攒到四个窗口也全部提交，免得上下文无限增长
+    end = max(text.rfind('。'), text.rfind('？'))
+    if end < 0 and len(state.raw) < Config.punc_window * 4:
+        state.next = len(state.raw) + Config.punc_window
+        return
+    if end < 0:
+        end = len(text) - 1
+    done = text[:end + 1]
+    advance = raw_position(state.raw, done)
+    if Config.format_num:
+        done = chinese_to_num(done)     # 转数字
+    if Config.format_spell:
+        done = adjust_space(done)       # 调空格
+    state.done += done
+    state.edge = (state.edge + state.raw[:advance])[-64:]
+    state.raw = state.raw[advance:]
+    state.start += advance
+    state.next = Config.punc_window
+
+
+def format_final(punc_model, task_id, text):
+    """
+    最终结果：已成句的部分直接沿用，只需格式化最后一个窗口
+    最后一个片段也可能重拼已成句部分末尾的 token，核对不上时整篇重新格式化
+    """
+    state = formatting.pop(task_id, None)
+    if (state is None or state.broken
+            or text[state.start - len(state.edge):state.start] != state.edge):
+        return format_text(text, punc_model)
+    return state.done + format_text(text[state.start:], punc_model)
+
+
+def join_tokens(tokens: List[str]) -> str:
+    """token 合并为文本"""
+    text = ' '.join(tokens).replace('@@ ', '')
+    text = re.sub('([^a-zA-Z0-9]) (?![a-zA-Z0-9])', r'\1', text)
+    return text
+
+
+def decode(recognizer, tasks: List[Task]) -> List[Task]:
+    """在识别进程中成批识别片段，结果写回各任务，并丢掉音频数据"""
+
+    # 片段预处理
+    streams = []
+    for task in tasks:
+        samples = np.frombuffer(task.data, dtype=np.float32)
+        task.duration = len(samples) / task.samplerate
+        stream = recognizer.create_stream()
+        stream.accept_waveform(task.samplerate, samples)
+        streams.append(stream)
+
+    # 一次识别整批片段
+    recognizer.decode_streams(streams)
+
+    for task, stream in zip(tasks, streams):
+        task.tokens = stream.result.tokens
+        task.timestamps = stream.result.timestamps
+        task.data = None
+
+    return tasks
+
+
+def cancel(task_id: str):
+    """任务被取消，丢弃已合并的结果和等待合并的片段"""
+    results.pop(task_id, None)
+    pending.pop(task_id, None)
+    touched.pop(task_id, None)
+    cancelled[task_id] = None
+    if len(cancelled) > 1024:
+        del cancelled[next(iter(cancelled))]
+
+
+def evict() -> List[str]:
+    """
+    清理久无新片段或超出数量上限的任务，如客户端上传途中崩溃遗留的中间结果
+    返回被清理的任务 id，格式化线程也要丢弃它们的进度
+    """
+    global evicted
+    expired = []
+    deadline = time.time() - Config.result_ttl
+    while touched:
+        task_id, moment = next(iter(touched.items()))
+        if moment > deadline and len(touched) <= Config.result_max:
+            break
+        cancel(task_id)
+        expired.append(task_id)
+    if expired:
+        evicted += len(expired)
+        console.print(f'清理了 {len(expired)} 个废弃任务的中间结果，累计清理 {evicted} 个')
+    return expired
+
+
+def reorder(task: Task):
+    """片段可能在不同识别进程乱序完成，按序号依次取出可以合并的片段"""
+
+    if task.task_id in cancelled:
+        return
+
+    # 记录收到片段的时刻
+    touched[task.task_id] = time.time()
+    touched.move_to_end(task.task_id)
+
+    waiting = pending.setdefault(task.task_id, {})
+    waiting[task.index] = task
+
+    # 下一个该合并的片段序号
+    index = 0
+    if task.task_id in results:
+        index = results[task.task_id].index
+
+    while index in waiting:
+        task = waiting.pop(index)
+        index += 1
+        yield task
+
+    if not waiting:
+        pending.pop(task.task_id, None)
+    if task.is_final and not waiting:
+        touched.pop(task.task_id, None)
+
+
+def recognize(task: Task):
 
     # inspect({key:value for key, value in task.__dict__.items() if not key.startswith('_') and key != 'data'})
     # todo 清空遗存的任务结果
 
     # 确保结果容器存在
     if task.task_id not in results:
-        results[task.task_id] = Result(task.task_id, task.socket_id, task.source)
+        results[task.task_id] = Result(task.task_id, task.socket_id, task.source, task.delta)
 
     # 取出结果容器
     result = results[task.task_id]
+    result.index = task.index + 1
 
-    # 片段预处理
-    samples = np.frombuffer(task.data, dtype=np.float32)
-    duration = len(samples) / task.samplerate
-    result.duration += duration - task.overlap
-    if task.is_final:
-        result.duration += task.overlap
-
-    # 识别片段
-    stream = recognizer.create_stream()
-    stream.accept_waveform(task.samplerate, samples)
-    recognizer.decode_stream(stream)
+    # 片段时长，加上片段之前略去的静音
+    duration = task.duration
+    result.duration += duration - task.overlap + task.skip
 
     # 记录识别时间
     result.time_start = task.time_start
@@ -56,44 +220,56 @@ def recognize(recognizer, punc_model, task: Task):
     result.time_complete = time.time()
 
     # 先粗去重，依据：字级时间戳
-    m = n = len(stream.result.timestamps)
-    for i, timestamp in enumerate(stream.result.timestamps, start=0):
-        if timestamp > task.overlap / 2: 
-            m = i
-            break
-    for i, timestamp in enumerate(stream.result.timestamps, start=1):
-        n = i
-        if timestamp > duration - task.overlap / 2:
-            break
-    if not result.timestamps:
-        m = 0
-    if task.is_final:
-        n = len(stream.result.timestamps)
+    # 在静音处切分的片段之间没有重叠，无需去重
+    timestamps = np.asarray(task.timestamps, dtype=np.float64)
+    m = 0
+    n = len(timestamps)
+    if task.overlap_prev and result.timestamps:
+        m = int(np.searchsorted(timestamps, task.overlap_prev / 2, side='right'))
+    if task.overlap:
+        n = min(n, int(np.searchsorted(timestamps, duration - task.overlap / 2, side='right')) + 1)
 
     # 再细去重，依据：在端点是否有重复的字
-    if result.tokens and result.tokens[-2:] == stream.result.tokens[m:n][:2]:
-        m += 2
-    elif result.tokens and result.tokens[-1:] == stream.result.tokens[m:n][:1]:
-        m += 1
+    if task.overlap_prev:
+        if result.tokens and result.tokens[-2:] == task.tokens[m:n][:2]:
+            m += 2
+        elif result.tokens and result.tokens[-1:] == task.tokens[m:n][:1]:
+            m += 1
 
-    # 最后与先前的结果合并
-    result.timestamps += [t + task.offset for t in stream.result.timestamps[m:n]]
-    result.tokens += [token for token in stream.result.tokens[m:n]]
-
-    # token 合并为文本
-    text = ' '.join(result.tokens).replace('@@ ', '')
-    text = re.sub('([^a-zA-Z0-9]) (?![a-zA-Z0-9])', r'\1', text)
+    # 新增的 token 拼成文本，追加到已有文本后
+    # 已有文本末尾的 token 要一并重拼，以处理它与新 token 之间的空格和 @@ 连接符
+    # 文本分段存放，重拼时只截短最后一段，不复制整篇文本
+    # 重拼会改变末尾 token 的文字（如 hel@@ 变为 hel），增量从它的起点 kept 算起
+    tokens = task.tokens[m:n]
+    kept, joined = result.length, ''
+    if tokens:
+        tail = result.tokens[-1:]
+        if tail:
+            kept -= len(tail[0])
+            last = result.pieces[-1]
+            result.pieces[-1] = last[:len(last) - len(tail[0])]
+        joined = join_tokens(tail + tokens)
+        result.pieces.append(joined)
+        result.length = kept + len(joined)
 
-    result.text = text
+    # 最后与先前的结果合并
+    timestamps = (timestamps[m:n] + task.offset).tolist()
+    result.timestamps.extend(timestamps)
+    result.tokens.extend(tokens)
 
+    # 中间结果只传递新增的部分，文字替换完整文字中从 kept 起的部分
     if not task.is_final:
-        return result
-
-    # 调整文本格式
-    result.text = format_text(text, punc_model)
+        return result.with_content(tokens, timestamps, joined, kept)
 
     # 若最后一个片段完成识别，从字典摘取任务
+    # 文本格式由格式化线程调整
     result = results.pop(task.task_id)
     result.is_final = True
+    result.text = ''.join(result.pieces)
+    result.pieces = []
+
+    # 接收增量结果的客户端已从中间结果得到先前的 token，最终结果只需新增部分和完整文本
+    if result.delta:
+        return result.with_content(tokens, timestamps, result.text)
 
     return result
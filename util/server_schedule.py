@@ -0,0 +1,61 @@
+import time
+import asyncio
+import threading
+
+from util.server_cosmic import Cosmic
+
+
+def watch_workers(dispatcher, loop: asyncio.AbstractEventLoop, wakeup: asyncio.Event):
+    """常驻线程：识别进程每识别完一批，就唤醒调度协程"""
+    while True:
+        dispatcher.finished.get()
+        loop.call_soon_threadsafe(wakeup.set)
+
+
+async def schedule():
+    """
+    调度协程：有片段入队或识别进程空闲时醒来，把排队的片段派给空闲的识别进程
+    向请求了确认的连接报告各任务已被取走的音频位置，客户端据此控制发送窗口
+    每秒向请求了排队状态的文件连接报告一次排队位置与预计开始时间
+    """
+
+    dispatcher = Cosmic.dispatcher
+    outboxes = Cosmic.outboxes
+    reported = time.time()
+
+    # 片段入队时由 Dispatcher.put 置位，识别进程空闲时由监视线程置位
+    wakeup = dispatcher.wakeup = asyncio.Event()
+    threading.Thread(target=watch_workers,
+                     args=(dispatcher, asyncio.get_running_loop(), wakeup),
+                     daemon=True).start()
+
+    while True:
+        wakeup.clear()
+        try:
+            # 同一任务一轮只确认一次，取最靠后的位置
+            acks = {}
+            for task in dispatcher.dispatch():
+                if task.ack:
+                    offset = task.offset + task.seconds - task.overlap
+                    _, acked = acks.get(task.task_id, (None, 0))
+                    acks[task.task_id] = (task.socket_id, max(acked, offset))
+            for task_id, (socket_id, offset) in acks.items():
+                outbox = outboxes.get(socket_id)
+                if outbox:
+                    outbox.notify({'type': 'ack', 'task_id': task_id, 'offset': offset})
+
+            if time.time() - reported >= 1:
+                reported = time.time()
+                for socket_id, status in dispatcher.status().items():
+                    outbox = outboxes.get(socket_id)
+                    if outbox and dispatcher.files[socket_id][0].queue_status:
+                        outbox.notify({'type': 'queue', **status})
+        except Exception as e:
+            print(e)
+
+        # 等待下一次唤醒，有文件在排队时最多等到下一次报告排队状态
+        timeout = max(0, reported + 1 - time.time()) if dispatcher.files else None
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,71 @@
+from collections import deque
+from multiprocessing import RawArray
+from multiprocessing.shared_memory import SharedMemory
+from typing import Union
+
+from util.server_classes import Task
+
+
+class SharedAudio:
+    """
+    主进程与识别进程共享的音频环形缓冲区
+
+    主进程把片段写入共享内存，任务只携带偏移与长度，
+    识别进程直接映射读取，用完后把片段的完成标志置 1。
+    多个识别进程会乱序用完片段，主进程按分配顺序回收连续完成的片段。
+    偏移都是从 0 开始累计的字节数，取模后才是缓冲区内的位置。
+    """
+
+    def __init__(self, size: int, slots: int = 4096):
+        self.shm = SharedMemory(create=True, size=size)
+        self.size = size
+        self.done = RawArray('b', slots)    # 片段完成标志，由识别进程置 1
+        self.written = 0                    # 以下仅主进程使用：已写入的字节数
+        self.consumed = 0                   # 已回收的字节数
+        self.pending = deque()              # 未回收的片段 (完成标志槽位, 片段结束偏移)
+        self.slot = 0                       # 下一个片段的完成标志槽位
+
+    def reclaim(self):
+        """按分配顺序回收已完成的片段"""
+        while self.pending and self.done[self.pending[0][0]]:
+            slot, end = self.pending.popleft()
+            self.done[slot] = 0
+            self.consumed = end
+
+    def put(self, data) -> Union[dict, None]:
+        """写入片段，返回任务所需的定位参数；空间不足时返回 None，由调用方改走队列传输"""
+        self.reclaim()
+        if len(self.pending) >= len(self.done):
+            return None
+        length = len(data)
+        pos = self.written % self.size
+
+        # 片段必须连续存放，放不下缓冲区末尾时，跳到开头
+        pad = self.size - pos if pos + length > self.size else 0
+        if self.written + pad + length - self.consumed > self.size:
+            return None
+        self.written += pad
+
+        start = self.written % self.size
+        self.shm.buf[start:start + length] = data
+        offset = self.written
+        self.written += length
+
+        slot = self.slot
+        self.slot = (self.slot + 1) % len(self.done)
+        self.pending.append((slot, self.written))
+        return {'shm_offset': offset, 'shm_length': length, 'shm_slot': slot}
+
+    def read(self, task: Task) -> memoryview:
+        """返回任务片段在共享内存中的视图，不复制"""
+        start = task.shm_offset % self.size
+        return self.shm.buf[start:start + task.shm_length]
+
+    def release(self, task: Task):
+        """任务用完，标记片段可回收"""
+        self.done[task.shm_slot] = 1
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
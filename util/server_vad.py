@@ -0,0 +1,72 @@
+from collections import deque
+from typing import Union
+
+import numpy as np
+
+from config import ServerConfig as Config
+from config import ModelPaths
+
+
+class VadCutter:
+    """
+    用 Silero VAD 在音频流中寻找静音，作为分段的切分点
+
+    只记录切分点，不保留语音数据：每当 VAD 从「有语音」变为「无语音」，
+    说明刚过去的一段静音已持续 min_silence 秒，取这段静音的中点作为候选切分点。
+    位置都是从任务开始累计的样本数。
+    """
+
+    def __init__(self):
+        import sherpa_onnx
+
+        config = sherpa_onnx.VadModelConfig()
+        config.silero_vad.model = str(ModelPaths.vad_model)
+        config.silero_vad.min_silence_duration = Config.vad_min_silence
+        config.sample_rate = 16000
+
+        self.vad = sherpa_onnx.VoiceActivityDetector(config, buffer_size_in_seconds=100)
+        self.window = config.silero_vad.window_size
+        self.margin = int(Config.vad_min_silence * 16000 / 2)
+
+        self.rest = np.zeros(0, dtype=np.float32)   # 不足一个窗口的剩余样本
+        self.fed = 0                                # 已送入 VAD 的样本数
+        self.speech = False                         # 上一个窗口是否处于语音中
+        self.cuts = deque()                         # 候选切分点
+
+    def feed(self, data: bytes):
+        """送入音频（float32 字节），更新候选切分点，耗时较长，宜在线程中调用"""
+        samples = np.concatenate([self.rest, np.frombuffer(data, dtype=np.float32)])
+        end = len(samples) // self.window * self.window
+        for i in range(0, end, self.window):
+            self.vad.accept_waveform(samples[i:i + self.window])
+            self.fed += self.window
+            speech = self.vad.is_speech_detected()
+            if self.speech and not speech:
+                self.cuts.append(self.fed - self.margin)
+            self.speech = speech
+
+            # 只要切分点，丢掉 VAD 缓存的语音段
+            while not self.vad.empty():
+                self.vad.pop()
+        self.rest = samples[end:]
+
+    def find(self, start: int, stop: int) -> Union[int, None]:
+        """返回 (start, stop] 之间最靠后的候选切分点，并丢弃 stop 之前的候选点"""
+        cut = None
+        while self.cuts and self.cuts[0] <= stop:
+            point = self.cuts.popleft()
+            if point > start:
+                cut = point
+        return cut
+
+    def skip(self, position: int):
+        """客户端略去了一段静音，缓冲区已清空，从 position 处重新开始检测"""
+        self.reset()
+        self.fed = position
+
+    def reset(self):
+        self.vad.reset()
+        self.rest = np.zeros(0, dtype=np.float32)
+        self.fed = 0
+        self.speech = False
+        self.cuts.clear()
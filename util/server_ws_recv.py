@@ -6,33 +6,99 @@ import websockets
 from base64 import b64decode
 
 from util.server_cosmic import console, Cosmic
-from util.server_classes import Task, Result
+from util.server_classes import Task, Result, Cancel
 from util.my_status import Status
+from util.server_ws_send import Outbox
+from util.server_vad import VadCutter
+from util.asyncio_to_thread import to_thread
+from config import ServerConfig as Config
 
 status_mic = Status('正在接收音频', spinner='point')
 
 
 class Cache:
     # 定义一个可变对象，用于保存音频数据、偏移时间
+    # 缓冲区用 bytearray：追加是均摊 O(1)，从头部删除不会搬移剩余数据
     def __init__(self):
-        self.chunks = b''
+        self.chunks = bytearray()
         self.offset = 0
         self.frame_num = 0
+        self.header = None      # 二进制模式下，当前任务的控制头
+        self.socket_slot = -1   # 连接在存活表中的槽位与序号
+        self.socket_serial = 0
+        self.index = 0          # 下一个片段的序号
+        self.task_id = None     # 正在接收的任务 id
+        self.overlap = 0        # 上一个片段与下一个片段的重叠时长
+        self.skip = 0           # 下一个片段之前略去的静音时长
+        self.vad = None         # VAD 分段模式下，寻找静音切分点
+        self.rejected = None    # 因繁忙被拒绝的任务 id，其后续消息一律忽略
 
+    def cut(self, size: int, advance: int):
+        """打包缓冲区开头 size 字节作为片段，再丢弃开头 advance 字节"""
+        with memoryview(self.chunks) as view:
+            packed = pack_segment(view[:size])
+        del self.chunks[:advance]
+        return packed
 
-async def message_handler(websocket, message, cache: Cache):
+    def reset(self):
+        """任务结束或取消后，还原缓冲区、偏移时长"""
+        self.chunks.clear()
+        self.offset = 0
+        self.frame_num = 0
+        self.header = None
+        self.index = 0
+        self.task_id = None
+        self.overlap = 0
+        self.skip = 0
+        if self.vad:
+            self.vad.reset()
+
+
+def pack_segment(view: memoryview) -> dict:
+    """
+    片段优先写入共享内存，任务只携带偏移和长度；
+    未启用共享内存或空间不足时，复制为 bytes 随任务走队列
+    返回构建 Task 所需的数据参数
+    """
+    if Cosmic.shared_audio is not None:
+        packed = Cosmic.shared_audio.put(view)
+        if packed is not None:
+            return {'data': None, **packed}
+    return {'data': bytes(view)}
+
+
+def build_task(websocket, message, cache: Cache, packed: dict, overlap: float, is_final: bool) -> Task:
+    """以缓冲区开头的音频构建任务，packed 是 pack_segment 返回的数据参数"""
+    skip, cache.skip = cache.skip, 0
+    return Task(source=message['source'],
+                offset=cache.offset,
+                task_id=message['task_id'], socket_id=str(websocket.id),
+                overlap=overlap, is_final=is_final,
+                time_start=message['time_start'],
+                time_submit=time.time(),
+                socket_slot=cache.socket_slot,
+                socket_serial=cache.socket_serial,
+                index=cache.index,
+                overlap_prev=cache.overlap,
+                skip=skip,
+                delta=message.get('result_delta', False),
+                queue_status=message.get('queue_status', False),
+                ack=message.get('ack', False), **packed)
+
+
+async def message_handler(websocket, message, data: bytes, cache: Cache):
     """处理得到的音频流数据"""
 
-    queue_in = Cosmic.queue_in
+    dispatcher = Cosmic.dispatcher
 
     global status_mic
     source = message['source']
     is_final = message['is_final']
-    is_start = not bool(cache.chunks)
+    is_start = cache.task_id != message['task_id']
 
     # 获取 id
     task_id = message['task_id']
-    socket_id = str(websocket.id)
+    cache.task_id = task_id
 
     # 获取分段长度（以多长的音频进行识别）
     seg_duration = message['seg_duration']
@@ -40,9 +106,24 @@ async def message_handler(websocket, message, cache: Cache):
     seg_threshold = seg_duration + seg_overlap * 2
 
 
-    # base64 解码音频数据，再
+    # 客户端略去了一段静音：缓冲区中的音频先作为一个片段提交（与下一个片段不重叠），
+    # 偏移再跳过这段静音，之后的时间戳仍与原音频对齐，静音时长随下一个片段计入任务时长
+    skip = message.get('skip', 0)
+    if skip:
+        if cache.chunks:
+            size = len(cache.chunks)
+            packed = cache.cut(size, size)
+            task = build_task(websocket, message, cache, packed, 0, False)
+            cache.offset += size / 4 / 16000
+            cache.overlap = 0
+            cache.index += 1
+            dispatcher.put(task)
+        cache.offset += skip
+        cache.skip += skip
+        if cache.vad:
+            cache.vad.skip(round(cache.offset * 16000))
+
     # 音频数据是 float32、单声道、16000采样率
-    data = b64decode(message['data'])
     cache.chunks += data
     cache.frame_num += len(data)
 
@@ -53,18 +134,41 @@ async def message_handler(websocket, message, cache: Cache):
         if source == 'file' and is_start:
             console.print('正在接收音频文件...')
 
+        # VAD 分段模式，在线程中寻找静音切分点
+        if Config.seg_mode == 'vad':
+            if cache.vad is None:
+                cache.vad = await to_thread(VadCutter)
+                cache.vad.fed = round(cache.offset * 16000)     # 任务开头可能已略去了静音
+            await to_thread(cache.vad.feed, data)
+
         # 若缓冲已达到分段长度，将片段作为任务提交
         while len(cache.chunks) / 4 / 16000 >= seg_threshold:
-            data = cache.chunks[:4 * 16000 * (seg_duration + seg_overlap)]
-            cache.chunks = cache.chunks[4 * 16000 * seg_duration:]
-            task = Task(source=message['source'],
-                        data=data, offset=cache.offset,
-                        task_id=task_id, socket_id=socket_id,
-                        overlap=seg_overlap, is_final=False,
-                        time_start=message['time_start'],
-                        time_submit=time.time())
-            cache.offset += seg_duration
-            queue_in.put(task)
+
+            # 优先在静音处切分，片段之间无需重叠
+            start = round(cache.offset * 16000)
+            cut = None
+            if cache.vad:
+                cut = cache.vad.find(start + 16000 * seg_duration // 2,
+                                     start + 16000 * seg_duration)
+            if cut:
+                size = advance = 4 * (cut - start)
+                overlap = 0
+            else:
+                size = 4 * 16000 * (seg_duration + seg_overlap)
+                advance = 4 * 16000 * seg_duration
+                overlap = seg_overlap
+
+            packed = cache.cut(size, advance)
+            task = build_task(websocket, message, cache, packed, overlap, False)
+            cache.offset += advance / 4 / 16000
+            cache.overlap = overlap
+            cache.index += 1
+
+            # 排队的音频过多时，暂停接收文件音频，由 TCP 向客户端施加背压
+            if source == 'file':
+                while dispatcher.queued >= Config.queue_max:
+                    await asyncio.sleep(0.1)
+            dispatcher.put(task)
 
     elif is_final:
         # 打印消息
@@ -74,18 +178,50 @@ async def message_handler(websocket, message, cache: Cache):
             print(f'音频文件接收完毕，时长 {cache.frame_num / 16000 / 4:.2f}s')
 
         # 客户端说片段结束，将缓冲区音频识别
-        task = Task(source=message['source'],
-                    data=cache.chunks[0:], offset=cache.offset,
-                    task_id=task_id, socket_id=socket_id,
-                    overlap=seg_overlap, is_final=True,
-                    time_start=message['time_start'],
-                    time_submit=time.time())
-        queue_in.put(task)
+        packed = cache.cut(len(cache.chunks), 0)
+        task = build_task(websocket, message, cache, packed, 0, True)
+        dispatcher.put(task)
 
         # 还原缓冲区、偏移时长
-        cache.chunks = b''
-        cache.offset = 0
-        cache.frame_num = 0
+        cache.reset()
+
+
+def admit(message, cache: Cache, outbox: Outbox) -> bool:
+    """
+    新的文件任务开始时，检查排队的音频是否过多
+    接收确认的客户端才会被拒绝，回复繁忙；旧版客户端只会被暂停接收
+    接受时先确认位置 0，客户端由此知道服务端支持流控
+    """
+    task_id = message['task_id']
+    if task_id == cache.rejected:
+        return False
+    if message['source'] != 'file' or task_id == cache.task_id or not message.get('ack'):
+        return True
+    if Cosmic.dispatcher.queued < Config.queue_busy:
+        outbox.notify({'type': 'ack', 'task_id': task_id, 'offset': 0})
+        return True
+    cache.rejected = task_id
+    outbox.notify({'type': 'busy', 'task_id': task_id, 'queued': round(Cosmic.dispatcher.queued)})
+    console.print(f'排队的音频已有 {Cosmic.dispatcher.queued:.0f}s，拒绝新的文件任务：{task_id}')
+    return False
+
+
+def cancel_task(task_id: str, cache: Cache):
+    """
+    客户端取消任务：丢弃缓冲区中的音频，撤下排队中的片段，
+    并通知合并进程丢弃已合并的结果、不再格式化
+    已派给识别进程的片段（最多一批）仍会识别完，由合并进程丢弃
+    """
+    if cache.task_id == task_id:
+        status_mic.stop()
+        cache.reset()
+
+    for task in Cosmic.dispatcher.cancel(task_id):
+        if task.shm_offset is not None:
+            Cosmic.shared_audio.release(task)
+
+    Cosmic.queue_merge.put(Cancel(task_id))
+    console.print(f'任务已取消：{task_id}')
 
 
 async def ws_recv(websocket):
@@ -93,9 +229,8 @@ async def ws_recv(websocket):
 
     # 登记 socket 到字典，以 socket id 字符串为索引
     sockets = Cosmic.sockets
-    sockets_id = Cosmic.sockets_id
+    sockets_alive = Cosmic.sockets_alive
     sockets[str(websocket.id)] = websocket
-    sockets_id.append(str(websocket.id))
     console.print(f'接客了：{websocket}\n', style='yellow')
 
     # 设定分段长度
@@ -106,15 +241,48 @@ async def ws_recv(websocket):
     # 片段缓冲区、偏移时长
     cache = Cache()
 
+    # 在存活表中登记连接
+    cache.socket_slot, cache.socket_serial = sockets_alive.open()
+
+    # 创建发件箱，启动该连接自己的发送协程
+    outbox = Outbox(websocket, Config.outbox_size)
+    Cosmic.outboxes[str(websocket.id)] = outbox
+    outbox_task = asyncio.create_task(outbox.run())
+
     # 接收数据
     try:
         async for message in websocket:
 
+            # 二进制帧：裸 PCM 数据，沿用当前任务的控制头
+            if isinstance(message, bytes):
+                if cache.header is None:
+                    continue
+                await message_handler(websocket, cache.header, message, cache)
+                continue
+
             # json 解码字符串
             message = json.loads(message)
 
-            # 处理数据
-            await message_handler(websocket, message, cache)
+            # 控制消息：取消任务
+            if message.get('type') == 'cancel':
+                cancel_task(message['task_id'], cache)
+                continue
+
+            # 繁忙时拒绝新的文件任务
+            if not admit(message, cache, outbox):
+                continue
+
+            # 旧版客户端：音频以 base64 放在 json 的 data 字段中
+            if 'data' in message:
+                await message_handler(websocket, message, b64decode(message['data']), cache)
+                continue
+
+            # 二进制模式：json 只是控制头，音频随后以二进制帧发来
+            # 结束的控制头、带有略去静音时长的控制头要立即处理
+            cache.header = message
+            if message['is_final'] or message.get('skip'):
+                await message_handler(websocket, message, b'', cache)
+                message.pop('skip', None)   # 之后的二进制帧沿用该控制头，不能重复略去
 
         console.print("ConnectionClosed...", )
     except websockets.ConnectionClosed:
@@ -127,4 +295,15 @@ async def ws_recv(websocket):
         status_mic.stop()
         status_mic.on = False
         sockets.pop(str(websocket.id))
-        sockets_id.remove(str(websocket.id))
+        Cosmic.outboxes.pop(str(websocket.id))
+        outbox_task.cancel()
+        if outbox.merged:
+            console.print(f'发件箱已满，合并了 {outbox.merged} 条中间结果')
+        sockets_alive.close(cache.socket_slot)
+
+        # 撤下该连接排队中的片段，释放其共享内存
+        for task in Cosmic.dispatcher.drop(str(websocket.id)):
+            if task.shm_offset is not None:
+                Cosmic.shared_audio.release(task)
+        if cache.task_id:
+            Cosmic.dispatcher.forget(cache.task_id)
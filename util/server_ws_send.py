@@ -1,29 +1,110 @@
 import json 
 import base64 
 import asyncio
+import threading
+from queue import Empty
+from collections import deque
 from multiprocessing import Queue
 
+import numpy as np
+import websockets
+
 from util.server_cosmic import console, Cosmic
 from util.server_classes import Result
-from util.asyncio_to_thread import to_thread
 from rich import inspect
 
 
-async def ws_send():
+class Outbox:
+    """
+    每个连接一个发件箱，由该连接自己的发送协程消费
+    慢客户端只会堆积自己的发件箱，不会拖慢 ws_send 给其它连接派发结果
+    """
 
-    queue_out = Cosmic.queue_out
-    sockets = Cosmic.sockets
+    def __init__(self, websocket, maxsize: int):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.results = deque()
+        self.event = asyncio.Event()
+        self.merged = 0                 # 因发件箱已满而合并的中间结果数
 
-    while True:
-        try:
-            # 获取识别结果（从多进程队列）
-            result: Result = await to_thread(queue_out.get)
+    def put(self, result: Result):
+        self.results.append(result)
+        self.limit()
+        self.event.set()
 
-            # 得到退出的通知
-            if result is None:
-                return
+    def notify(self, message: dict):
+        """
+        放入一条状态消息（如确认、排队状态），原样发出
+        同一任务同类的状态消息只保留最新的一条，不会堆积
+        """
+        for i, older in enumerate(self.results):
+            if (isinstance(older, dict) and older.get('type') == message.get('type')
+                    and older.get('task_id') == message.get('task_id')):
+                self.results[i] = message
+                break
+        else:
+            self.results.append(message)
+            self.limit()
+        self.event.set()
+
+    def limit(self):
+        """
+        发件箱超出容量时，合并中间结果，直到不超出容量
+        只剩最终结果和各任务最新的状态消息时无法再合并，但它们的数量与连接上的任务数相当
+        """
+        while len(self.results) > self.maxsize and self.merge():
+            pass
+
+    def merge(self) -> bool:
+        """
+        中间结果只含新增内容，不能丢弃，
+        把最旧的中间结果并入同一任务的下一个中间结果，两者之间可以隔着其它消息
+        较新结果的文字从 splice 处替换，合并时先截去较旧结果中被替换的部分；
+        较旧结果没有新字时，较新结果可能从更早的位置替换
+        返回是否合并了
+        """
+        for i, older in enumerate(self.results):
+            if isinstance(older, dict) or older.is_final:
+                continue
+            for j in range(i + 1, len(self.results)):
+                newer = self.results[j]
+                if isinstance(newer, dict) or newer.task_id != older.task_id:
+                    continue
+                if newer.is_final:
+                    break
+                newer.tokens = older.tokens + newer.tokens
+                newer.timestamps = older.timestamps + newer.timestamps
+                newer.text = older.text[:max(0, newer.splice - older.splice)] + newer.text
+                newer.splice = min(older.splice, newer.splice)
+                del self.results[i]
+                self.merged += 1
+                return True
+        return False
+
+    async def run(self):
+        while True:
+            while not self.results:
+                self.event.clear()
+                await self.event.wait()
+            result = self.results.popleft()
+
+            # 状态消息原样发出
+            if isinstance(result, dict):
+                try:
+                    await self.websocket.send(json.dumps(result))
+                except websockets.ConnectionClosed:
+                    return
+                continue
 
             # 构建消息
+            # 接收增量结果的客户端，时间戳减去第一个时间戳后打包为 float32 数组再 base64 编码
+            # 长音频的绝对时间戳用 float32 会损失精度，相对时间戳则不会
+            timestamps = result.timestamps
+            timestamp_base = timestamps[0] if timestamps else 0
+            if result.delta:
+                timestamps = base64.b64encode(
+                    (np.asarray(timestamps, dtype=np.float64) - timestamp_base).astype(np.float32).tobytes()
+                ).decode('utf-8')
             message = {
                 'task_id': result.task_id,
                 'duration': result.duration,
@@ -31,22 +112,73 @@ async def ws_send():
                 'time_submit': result.time_submit,
                 'time_complete': result.time_complete,
                 'tokens': result.tokens,
-                'timestamps': result.timestamps,
+                'timestamps': timestamps,
                 'text': result.text,
                 'is_final': result.is_final,
             }
+            if result.delta:
+                message['timestamp_base'] = timestamp_base     # 时间戳的基准
+                message['splice'] = result.splice              # text 替换完整文字中从此位置起的部分
+
+            # 发送消息
+            try:
+                await self.websocket.send(json.dumps(message))
+            except websockets.ConnectionClosed:
+                return
+
+
+def pump_results(queue_out: Queue, loop: asyncio.AbstractEventLoop, results: asyncio.Queue):
+    """
+    常驻线程：从多进程队列成批取出识别结果，一次性交给事件循环
+    避免每个结果都向线程池提交一次任务
+    """
 
-            # 获得 socket
-            websocket = next(
-                (ws for ws in sockets.values() if str(ws.id) == result.socket_id),
-                None,
-            )
+    def deliver(batch):
+        for result in batch:
+            results.put_nowait(result)
 
-            if not websocket:
+    while True:
+        # 阻塞等到第一个结果，再把队列里已有的结果一并取走
+        batch = [queue_out.get()]
+        while batch[-1] is not None and len(batch) < 64:
+            try:
+                batch.append(queue_out.get_nowait())
+            except Empty:
+                break
+        loop.call_soon_threadsafe(deliver, batch)
+
+        # 得到退出的通知
+        if batch[-1] is None:
+            return
+
+
+async def ws_send():
+
+    queue_out = Cosmic.queue_out
+    outboxes = Cosmic.outboxes
+
+    # 启动结果泵线程
+    results = asyncio.Queue()
+    threading.Thread(target=pump_results,
+                     args=(queue_out, asyncio.get_running_loop(), results),
+                     daemon=True).start()
+
+    while True:
+        try:
+            # 获取识别结果（由结果泵线程从多进程队列转来）
+            result: Result = await results.get()
+
+            # 得到退出的通知
+            if result is None:
+                return
+
+            # 按 socket id 找到连接的发件箱
+            outbox = outboxes.get(result.socket_id)
+            if not outbox:
                 continue
 
-            # 发送消息
-            await websocket.send(json.dumps(message))
+            # 放入发件箱，由连接自己的发送协程发出
+            outbox.put(result)
 
             if result.source == 'mic':
                 console.print(f'识别结果：\n    [green]{result.text}')
@@ -58,4 +190,3 @@ async def ws_send():
         except Exception as e:
             print(e)
 
-